@@ -0,0 +1,133 @@
+# stdlib imports
+import collections
+import datetime
+import pathlib
+import time
+import types
+
+# vendor imports
+from PIL import Image
+
+# local imports
+import guardiandeck.config as config
+
+
+class FakeDeck:
+    # Mimics a 15 key Stream Deck Original
+    KEY_COUNT = 15
+    KEY_COLS = 5
+    KEY_ROWS = 3
+
+    def __init__(self, imageFormat="JPEG", flip=(True, True), rotation=0):
+        self.imageFormat = {
+            "size": (72, 72),
+            "format": imageFormat,
+            "flip": flip,
+            "rotation": rotation,
+        }
+        self.BLANK_KEY_IMAGE = Image.new("RGB", (72, 72)).tobytes()
+
+        # Recent key writes, as (monotonic time, key, bytes written). Bounded,
+        # so long soak runs don't count the log itself as growth.
+        self.writes = collections.deque(maxlen=4096)
+        self.keyCallback = None
+        self.isOpen = False
+
+    def open(self):
+        self.isOpen = True
+
+    def close(self):
+        self.isOpen = False
+
+    def reset(self):
+        pass
+
+    def id(self):
+        return f"fake-{id(self)}"
+
+    def deck_type(self):
+        return "Fake Stream Deck"
+
+    def key_count(self):
+        return self.KEY_COUNT
+
+    def key_layout(self):
+        return (self.KEY_ROWS, self.KEY_COLS)
+
+    def key_image_format(self):
+        return self.imageFormat
+
+    def set_key_image(self, key, image):
+        self.writes.append((time.monotonic(), key, len(image or b"")))
+
+    def set_key_callback_async(self, callback, loop=None):
+        self.keyCallback = callback
+
+    async def press(self, key):
+        # Simulate a full press and release of a key
+        await self.keyCallback(self, key, True)
+        await self.keyCallback(self, key, False)
+
+
+class FakeDeviceManager:
+    def __init__(self, decks=None):
+        self.decks = decks if decks is not None else [FakeDeck()]
+
+    def enumerate(self):
+        return self.decks
+
+
+class FakeProp:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class FakeProps:
+    def __init__(self, values):
+        for name, value in values.items():
+            setattr(self, name, FakeProp(value))
+
+    def sync(self):
+        pass
+
+
+def installFakeChassis(dataPath):
+    # Point the app at a throwaway data directory with credentials that
+    # won't need refreshing, so nothing touches the real user config
+    dataPath = pathlib.Path(dataPath)
+    (dataPath / "cache").mkdir(parents=True, exist_ok=True)
+
+    later = (datetime.datetime.now() + datetime.timedelta(days=30)).isoformat()
+    chassis = types.SimpleNamespace(
+        store=types.SimpleNamespace(
+            path=dataPath, root=pathlib.Path(config.__file__).parent
+        ),
+        props=FakeProps(
+            {
+                "apiKey": "benchmark",
+                "bungieId": "1",
+                "token": "benchmark",
+                "tokenExpiration": later,
+                "refreshToken": "benchmark",
+                "refreshTokenExpiration": later,
+                "manifestVersion": "",
+                "manifestContentName": "",
+                "tileCacheSize": 32 * 1024 * 1024,
+                "pollProfile": False,
+                "membershipId": "",
+                "membershipType": None,
+                "characterId": "",
+                "characters": None,
+                "loadouts": {},
+            }
+        ),
+    )
+
+    config.chassis = chassis
+    return chassis
@@ -0,0 +1,357 @@
+# stdlib imports
+import copy
+import io
+import json
+import pathlib
+import random
+import sqlite3
+import tempfile
+import zipfile
+
+# vendor imports
+from PIL import Image
+
+# local imports
+import guardiandeck.helpers as helpers
+from guardiandeck.manifest import hashToId
+
+membershipType = 3
+membershipId = "4611686018400000001"
+characterIds = ["2305843009200000001", "2305843009200000002"]
+
+# Kinetic, energy and power weapon buckets, in bucket index order
+weaponBuckets = [1498876634, 2465295065, 953998645]
+
+# Hash the manifest sanity check looks up on every open
+humanRaceHash = 2803282938
+
+# Every weapon bucket holds one equipped and this many carried items, which
+# is more than fits on one page of a bucket menu
+carriedPerBucket = 12
+
+# Inventory definitions that aren't weapons, to give the manifest some bulk
+fillerItems = 4000
+
+
+def envelope(response):
+    # The wrapper every Bungie API response comes in
+    return {
+        "Response": response,
+        "ErrorCode": 1,
+        "ThrottleSeconds": 0,
+        "ErrorStatus": "Success",
+        "Message": "Ok",
+        "MessageData": {},
+    }
+
+
+def iconRoute(kind, n):
+    return f"/common/destiny2_content/icons/bench_{kind}_{n}.png"
+
+
+def iconBytes(seed, size=96):
+    # Noisy enough that the PNG encoder can't shortcut it
+    rng = random.Random(seed)
+    image = Image.new("RGB", (size, size))
+    image.putdata(
+        [
+            (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            for _ in range(size * size)
+        ]
+    )
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def itemHash(bucketIndex, n):
+    return 1000000 + bucketIndex * 1000 + n
+
+
+def buildContent(path):
+    # A miniature content database with the tables the deck reads
+    connection = sqlite3.connect(path)
+    tables = {
+        "DestinyInventoryItemDefinition": [],
+        "DestinyInventoryBucketDefinition": [],
+        "DestinyRaceDefinition": [],
+        "DestinyClassDefinition": [],
+    }
+
+    for bucketIndex, bucketHash in enumerate(weaponBuckets):
+        tables["DestinyInventoryBucketDefinition"].append(
+            {"hash": bucketHash, "index": bucketIndex}
+        )
+        for n in range(carriedPerBucket + 1):
+            tables["DestinyInventoryItemDefinition"].append(
+                {
+                    "hash": itemHash(bucketIndex, n),
+                    "displayProperties": {
+                        "name": f"Weapon {bucketIndex}.{n}",
+                        "icon": iconRoute("item", itemHash(bucketIndex, n)),
+                    },
+                    "equippingBlock": {"ammoType": bucketIndex + 1},
+                    "defaultDamageType": 1 + (n % 4),
+                    "inventory": {"bucketTypeHash": bucketHash},
+                }
+            )
+
+    for n in range(fillerItems):
+        tables["DestinyInventoryItemDefinition"].append(
+            {
+                "hash": 3000000000 + n,
+                "displayProperties": {"name": f"Filler {n}", "icon": None},
+                "inventory": {"bucketTypeHash": 0},
+                "flavorText": "x" * 200,
+            }
+        )
+
+    tables["DestinyRaceDefinition"].append(
+        {"hash": humanRaceHash, "displayProperties": {"name": "Human"}}
+    )
+    tables["DestinyClassDefinition"].append(
+        {"hash": 671679327, "displayProperties": {"name": "Hunter"}}
+    )
+
+    with connection:
+        for table, definitions in tables.items():
+            connection.execute(
+                f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, json BLOB)"
+            )
+            connection.executemany(
+                f"INSERT INTO {table} VALUES (?, ?)",
+                (
+                    (hashToId(definition["hash"]), json.dumps(definition))
+                    for definition in definitions
+                ),
+            )
+    connection.close()
+
+
+def buildInventory(characterIndex=0):
+    equipment, inventory, instances = [], [], {}
+
+    for bucketIndex, bucketHash in enumerate(weaponBuckets):
+        for n in range(carriedPerBucket + 1):
+            instanceId = f"69{characterIndex}{bucketIndex}{n:04d}"
+            item = {
+                "itemHash": itemHash(bucketIndex, n),
+                "itemInstanceId": instanceId,
+                "bucketHash": bucketHash,
+                "quantity": 1,
+            }
+            instances[instanceId] = {
+                "damageType": 1 + (n % 4),
+                "primaryStat": {"statHash": 1480404414, "value": 1500 + n},
+                "isEquipped": n == 0,
+            }
+            (equipment if n == 0 else inventory).append(item)
+
+    return {
+        "equipment": {"data": {"items": equipment}},
+        "inventory": {"data": {"items": inventory}},
+        "itemComponents": {"instances": {"data": instances}},
+    }
+
+
+def mutateInventory(inventoryData):
+    # Swap the equipped kinetic weapon with the first carried one, and
+    # bump the power of the equipped energy weapon
+    mutated = copy.deepcopy(inventoryData)
+    equipment = mutated["equipment"]["data"]["items"]
+    inventory = mutated["inventory"]["data"]["items"]
+
+    carriedIndex = next(
+        i
+        for i, item in enumerate(inventory)
+        if item["bucketHash"] == weaponBuckets[0]
+    )
+    equipment[0], inventory[carriedIndex] = (
+        inventory[carriedIndex],
+        equipment[0],
+    )
+
+    instances = mutated["itemComponents"]["instances"]["data"]
+    instances[equipment[1]["itemInstanceId"]]["primaryStat"]["value"] += 1
+
+    return mutated
+
+
+def buildProfileInventories(inventories):
+    # The profile endpoint's view of several character inventories at once
+    profileData = {
+        "characterInventories": {"data": {}},
+        "characterEquipment": {"data": {}},
+        "itemComponents": {"instances": {"data": {}}},
+    }
+    for characterId, inventoryData in inventories.items():
+        profileData["characterEquipment"]["data"][characterId] = {
+            "items": inventoryData["equipment"]["data"]["items"]
+        }
+        profileData["characterInventories"]["data"][characterId] = {
+            "items": inventoryData["inventory"]["data"]["items"]
+        }
+        profileData["itemComponents"]["instances"]["data"].update(
+            inventoryData["itemComponents"]["instances"]["data"]
+        )
+    return profileData
+
+
+def characterRoute(characterId):
+    return (
+        f"/Platform/Destiny2/{membershipType}/Profile/{membershipId}"
+        f"/Character/{characterId}/?components=201,205,300"
+    )
+
+
+def generate(fixtureDir, version="bench.1"):
+    fixtureDir = pathlib.Path(fixtureDir)
+    fixtureDir.mkdir(parents=True, exist_ok=True)
+    routes = {}
+
+    def add(route, name, body, type="application/json", method=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        (fixtureDir / name).write_bytes(body)
+        routes[f"{method} {route}" if method else route] = {
+            "file": name,
+            "type": type,
+        }
+
+    # Manifest metadata and the zipped content database
+    contentRoute = (
+        f"/common/destiny2_content/sqlite/en/world_{version}.content"
+    )
+    add(
+        "/Platform/Destiny2/Manifest/",
+        "manifest.json",
+        envelope(
+            {
+                "version": version,
+                "mobileWorldContentPaths": {"en": contentRoute},
+            }
+        ),
+    )
+    with tempfile.TemporaryDirectory() as tempDir:
+        contentPath = pathlib.Path(tempDir) / f"world_{version}.content"
+        buildContent(contentPath)
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zipFile:
+            zipFile.write(contentPath, contentPath.name)
+        add(contentRoute, "content.zip", archive.getvalue(), "application/zip")
+
+    # Account, profile and character inventories
+    add(
+        "/Platform/User/GetMembershipsById/1/0/",
+        "memberships.json",
+        envelope(
+            {
+                "destinyMemberships": [
+                    {
+                        "membershipId": membershipId,
+                        "membershipType": membershipType,
+                    }
+                ]
+            }
+        ),
+    )
+    characters, inventories = {}, {}
+    for i, characterId in enumerate(characterIds):
+        characters[characterId] = {
+            "characterId": characterId,
+            "light": 1510 + i,
+            "raceHash": humanRaceHash,
+            "classHash": 671679327,
+            "emblemPath": iconRoute("emblem", i),
+        }
+        inventories[characterId] = buildInventory(i)
+        add(
+            characterRoute(characterId),
+            f"inventory.{i}.json",
+            envelope(inventories[characterId]),
+        )
+        add(
+            iconRoute("emblem", i),
+            f"emblem.{i}.png",
+            iconBytes(f"emblem{i}"),
+            "image/png",
+        )
+    add(
+        f"/Platform/Destiny2/{membershipType}/Profile/{membershipId}/"
+        "?components=200",
+        "profile.json",
+        envelope({"characters": {"data": characters}}),
+    )
+    add(
+        f"/Platform/Destiny2/{membershipType}/Profile/{membershipId}/"
+        "?components=201,205,300",
+        "profile.inventories.json",
+        envelope(buildProfileInventories(inventories)),
+    )
+
+    # Every image the deck will ask for
+    for bucketIndex in range(len(weaponBuckets)):
+        for n in range(carriedPerBucket + 1):
+            hash = itemHash(bucketIndex, n)
+            add(
+                iconRoute("item", hash),
+                f"item.{hash}.png",
+                iconBytes(hash),
+                "image/png",
+            )
+    for ammoType, route in helpers.ammoIconRoutes.items():
+        add(
+            route,
+            f"ammo.{ammoType}.png",
+            iconBytes(f"ammo{ammoType}", 48),
+            "image/png",
+        )
+
+    # Writes just need to succeed
+    add(
+        "/Platform/Destiny2/Actions/Items/EquipItem/",
+        "equip.json",
+        envelope(0),
+        method="POST",
+    )
+    add(
+        "/Platform/Destiny2/Actions/Items/EquipItems/",
+        "equipMany.json",
+        envelope({"equipResults": []}),
+        method="POST",
+    )
+
+    with (fixtureDir / "routes.json").open("w") as routesFile:
+        json.dump(routes, routesFile, indent=2)
+    return fixtureDir
+
+
+def writeMutation(fixtureDir, characterIndex=0):
+    # Replace a character's inventory with a changed copy of itself
+    fixtureDir = pathlib.Path(fixtureDir)
+    path = fixtureDir / f"inventory.{characterIndex}.json"
+    inventoryData = json.loads(path.read_text())["Response"]
+    path.write_text(json.dumps(envelope(mutateInventory(inventoryData))))
+
+
+def writeSequence(fixtureDir, length, changeEvery=5, characterIndex=0):
+    # A series of polls of one character, where every few polls something
+    # is swapped or levelled up, served one after the other from its route
+    fixtureDir = pathlib.Path(fixtureDir)
+    path = fixtureDir / f"inventory.{characterIndex}.json"
+    inventoryData = json.loads(path.read_text())["Response"]
+
+    sequence = []
+    for i in range(length):
+        if i and i % changeEvery == 0:
+            inventoryData = mutateInventory(inventoryData)
+        name = f"inventory.{characterIndex}.{i}.json"
+        (fixtureDir / name).write_text(json.dumps(envelope(inventoryData)))
+        sequence.append(name)
+
+    routesPath = fixtureDir / "routes.json"
+    routes = json.loads(routesPath.read_text())
+    routes[characterRoute(characterIds[characterIndex])] = {
+        "sequence": sequence
+    }
+    routesPath.write_text(json.dumps(routes, indent=2))
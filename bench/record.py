@@ -0,0 +1,117 @@
+# stdlib imports
+import argparse
+import json
+import pathlib
+import time
+
+# local imports
+from guardiandeck.api import BungieClient
+import guardiandeck.config as config
+import guardiandeck.helpers as helpers
+
+
+def record(fixtureDir, characterIndex=0, polls=1, interval=10):
+    # Record the responses for the configured account, so the benchmark can
+    # be replayed against real data instead of the synthetic fixtures
+    fixtureDir = pathlib.Path(fixtureDir)
+    fixtureDir.mkdir(parents=True, exist_ok=True)
+    api = BungieClient(config.chassis.props.apiKey.get())
+    routes = {}
+
+    def save(route, name, body, type="application/json"):
+        (fixtureDir / name).write_bytes(body)
+        routes[route] = {"file": name, "type": type}
+
+    def call(route, name=None):
+        response = api.request(
+            "get",
+            config.bungie + route,
+            headers={
+                "X-API-Key": api.apiKey,
+                "Authorization": f"Bearer {config.chassis.props.token.get()}",
+            },
+        )
+        response.raise_for_status()
+        if name:
+            save(route, name, response.content)
+        return response.json()["Response"]
+
+    def image(route, name, type="image/png"):
+        response = api.request("get", config.bungie + route)
+        response.raise_for_status()
+        save(route, name, response.content, type)
+
+    # The manifest, and the full content archive it points at
+    manifestData = call("/Platform/Destiny2/Manifest/", "manifest.json")
+    image(
+        manifestData["mobileWorldContentPaths"]["en"],
+        "content.zip",
+        "application/zip",
+    )
+
+    bungieId = config.chassis.props.bungieId.get()
+    player = call(
+        f"/Platform/User/GetMembershipsById/{bungieId}/0/", "memberships.json"
+    )
+    membership = player["destinyMemberships"][0]
+    profileRoute = (
+        f"/Platform/Destiny2/{membership['membershipType']}/Profile/"
+        f"{membership['membershipId']}/"
+    )
+    profile = call(f"{profileRoute}?components=200", "profile.json")
+
+    characters = profile["characters"]["data"]
+    for i, (characterId, character) in enumerate(characters.items()):
+        image(character["emblemPath"], f"emblem.{i}.png")
+    characterId = list(characters)[characterIndex]
+    inventoryRoute = (
+        f"{profileRoute}Character/{characterId}/?components=201,205,300"
+    )
+    inventoryData = call(inventoryRoute, f"inventory.{characterIndex}.json")
+
+    # Optionally keep polling, so the soak test can replay real changes
+    if polls > 1:
+        sequence = [f"inventory.{characterIndex}.json"]
+        for i in range(1, polls):
+            time.sleep(interval)
+            name = f"inventory.{characterIndex}.{i}.json"
+            call(inventoryRoute, name)
+            sequence.append(name)
+        routes[inventoryRoute] = {"sequence": sequence}
+
+    # The icon of everything the character has on them
+    items = (
+        inventoryData["equipment"]["data"]["items"]
+        + inventoryData["inventory"]["data"]["items"]
+    )
+    for itemHash in {item["itemHash"] for item in items}:
+        definition = call(
+            f"/Platform/Destiny2/Manifest/DestinyInventoryItemDefinition/{itemHash}/"
+        )
+        icon = definition["displayProperties"].get("icon", None)
+        if icon:
+            image(icon, f"item.{itemHash}.png")
+
+    for ammoType, route in helpers.ammoIconRoutes.items():
+        image(route, f"ammo.{ammoType}.png")
+
+    api.close()
+    with (fixtureDir / "routes.json").open("w") as routesFile:
+        json.dump(routes, routesFile, indent=2)
+    print(f"Recorded {len(routes)} responses to {fixtureDir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Record Bungie API responses for the benchmarks"
+    )
+    parser.add_argument("fixtureDir")
+    parser.add_argument("--character", type=int, default=0)
+    parser.add_argument(
+        "--polls", type=int, default=1, help="inventory snapshots to record"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=10, help="seconds between them"
+    )
+    args = parser.parse_args()
+    record(args.fixtureDir, args.character, args.polls, args.interval)
@@ -0,0 +1,369 @@
+# stdlib imports
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+
+# local imports
+from bench.fakes import FakeDeck, FakeDeviceManager, installFakeChassis
+import bench.fixtures as fixtures
+from bench.stub import StubServer
+import guardiandeck.config as config
+import guardiandeck.trace as trace
+
+resultsDir = pathlib.Path(__file__).parent / "results"
+
+
+class Bench:
+    def __init__(self, dataPath, repeat, verbose=False, decks=1):
+        self.dataPath = dataPath
+        self.repeat = repeat
+        self.verbose = verbose
+        self.decks = decks
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        # Name -> every timing (in seconds) taken for it
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def quiet(self):
+        # The app prints as it goes, which would swamp the results
+        if self.verbose:
+            yield
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield
+
+    def run(self, coroutine):
+        with self.quiet():
+            return self.loop.run_until_complete(coroutine)
+
+    def time(self, name, factory, repeat=1, before=None):
+        for _ in range(repeat):
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            self.run(factory())
+            self.timings.setdefault(name, []).append(
+                time.perf_counter() - start
+            )
+
+    async def settle(self):
+        # Wait for whatever the app started in the background
+        pending = asyncio.all_tasks(self.loop) - {asyncio.current_task()}
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def newDeck(self):
+        # Imported here, so the fake chassis is in place before the app's
+        # modules read their configuration
+        from guardiandeck.deck import GuardianDeck
+
+        # Extra decks alternate image formats, so tiles can't all be shared
+        devices = [
+            FakeDeck("JPEG" if i % 2 == 0 else "BMP")
+            for i in range(self.decks)
+        ]
+        with self.quiet():
+            deck = GuardianDeck(FakeDeviceManager(devices))
+        deck.loop = self.loop
+        for surface in deck.surfaces:
+            surface.device.set_key_callback_async(
+                surface.pressStack, loop=self.loop
+            )
+        return deck
+
+    def closeDeck(self, deck):
+        deck.tileCache.sync()
+        deck.api.close()
+        deck.workers.shutdown(wait=True)
+        if getattr(deck, "manifest", None) is not None:
+            deck.manifest.close()
+        deck.closeDeck()
+
+    def startup(self, deck, name=None):
+        from guardiandeck.stages.CharacterSelection import (
+            CharacterSelectionStage,
+        )
+
+        self.run(deck.startup())
+        for surface in deck.surfaces:
+            if not isinstance(surface._stack[0], CharacterSelectionStage):
+                raise RuntimeError("Startup did not reach character selection")
+
+        # Time from constructing the deck to each startup milestone
+        if name is not None:
+            for milestone, elapsed in deck.milestones.items():
+                suffix = milestone.split(".", 1)[1]
+                self.timings[f"{name}.{suffix}"] = [elapsed]
+
+    def measure(self, fixtureDir, server):
+        import guardiandeck.helpers as helpers
+
+        # Cold start: no manifest, icons or tiles cached yet
+        deck = self.newDeck()
+        start = time.perf_counter()
+        self.startup(deck, "startup.cold")
+        self.timings["startup.cold"] = [time.perf_counter() - start]
+
+        # Choose the first character on every deck, then take the first
+        # full poll
+        surface = deck.surfaces[0]
+        for each in deck.surfaces:
+            self.run(each.device.press(each.key(1, 1)))
+        self.time("poll.first", deck.pollOnce)
+
+        # Redraw every key, and then redraw when nothing has changed
+        def forget():
+            surface._keyHashes = [False] * surface.device.key_count()
+
+        self.time("render.full", surface.renderStack, self.repeat, forget)
+        self.time("render.noop", surface.renderStack, self.repeat)
+
+        # Open and close a bucket menu, first cold and then warm
+        async def openBucket():
+            await surface.device.press(surface.key(4, 0))
+
+        async def closeBucket():
+            await surface.device.press(surface.key(4, 0))
+
+        self.time("bucket.push.cold", openBucket)
+        self.time("bucket.pop", closeBucket)
+        for _ in range(self.repeat):
+            self.time("bucket.push.warm", openBucket)
+            self.time("bucket.pop", closeBucket)
+
+        # Flip to the next page of a bucket menu and back, which were both
+        # drawn ahead of time
+        async def nextPage():
+            await surface.device.press(surface.key(0, 1))
+
+        async def previousPage():
+            await surface.device.press(surface.key(0, 0))
+
+        self.run(openBucket())
+        for _ in range(self.repeat):
+            self.run(self.settle())
+            self.time("bucket.page", nextPage)
+            self.run(self.settle())
+            self.time("bucket.page", previousPage)
+        self.run(closeBucket())
+
+        # Equip from a bucket menu, which shows before the API confirms it.
+        # The stub never changes, so the next poll rolls it back.
+        async def equipItem():
+            await surface.device.press(surface.key(3, 0))
+
+        for _ in range(self.repeat):
+            self.run(openBucket())
+            self.time("equip.optimistic", equipItem)
+            self.run(closeBucket())
+            self.time("poll.rollback", deck.pollOnce)
+
+        # Item tiles; from memory, from the disk tier, and drawn from scratch
+        item = deck.inventoryData["equipment"]["data"]["items"][0]
+
+        async def itemIcon():
+            await helpers.generateItemIcon(surface, deck.inventoryData, item)
+
+        self.time("tile.memory", itemIcon, self.repeat)
+        self.time("tile.disk", itemIcon, self.repeat, deck.imageCache.clear)
+
+        itemInfo = self.run(deck.queryItem(item["itemHash"]))
+        icon = self.run(deck.fetchCachedImage(itemInfo.icon))
+        ammoIcon = self.run(
+            deck.fetchCachedImage(helpers.ammoIconRoutes[itemInfo.ammoType])
+        )
+
+        async def drawTile():
+            helpers.composeItemTile(
+                surface,
+                icon,
+                ammoIcon,
+                3,
+                1500,
+                itemInfo.icon,
+                itemInfo.ammoType,
+            )
+
+        self.time("tile.draw", drawTile, self.repeat)
+
+        # Polls that find nothing new, and polls that find a change
+        self.time("poll.unchanged", deck.pollOnce, self.repeat)
+
+        inventoryPath = fixtureDir / "inventory.0.json"
+        original = inventoryPath.read_bytes()
+        fixtures.writeMutation(fixtureDir)
+        mutated = inventoryPath.read_bytes()
+
+        for i in range(self.repeat):
+            inventoryPath.write_bytes(mutated if i % 2 == 0 else original)
+            self.time("poll.changed", deck.pollOnce)
+
+        # A change rebuilds the menus of the affected buckets in the
+        # background, so once that's done opening one shouldn't draw at all
+        for i in range(self.repeat):
+            inventoryPath.write_bytes(mutated if i % 2 == 0 else original)
+            self.run(deck.pollOnce())
+            self.run(self.settle())
+            self.time("bucket.push.prewarmed", openBucket)
+            self.run(closeBucket())
+
+        # Save a loadout, swap a weapon, then put the loadout back on
+        inventoryPath.write_bytes(original)
+        self.run(deck.refreshInventory())
+        surface.hold1 = True
+        self.run(surface.device.press(surface.key(1, 2)))
+        surface.hold1 = False
+        inventoryPath.write_bytes(mutated)
+        self.run(deck.refreshInventory())
+
+        async def applyLoadout():
+            await surface.device.press(surface.key(1, 2))
+
+        self.time("loadout.apply", applyLoadout)
+        inventoryPath.write_bytes(original)
+
+        # Every character at once, through the profile endpoint
+        config.chassis.props.pollProfile.set(True)
+        self.time("poll.profile", deck.pollOnce, self.repeat)
+        config.chassis.props.pollProfile.set(False)
+
+        self.closeDeck(deck)
+
+        # Warm start: everything from the first run is now on disk
+        deck = self.newDeck()
+        start = time.perf_counter()
+        self.startup(deck, "startup.warm")
+        self.timings["startup.warm"] = [time.perf_counter() - start]
+        self.closeDeck(deck)
+
+        self.requests = sum(server.hits.values())
+
+    def results(self):
+        stats = {}
+        for name, values in self.timings.items():
+            ordered = sorted(values)
+            stats[name] = {
+                "count": len(ordered),
+                "p50": trace.percentile(ordered, 0.50) * 1000,
+                "p95": trace.percentile(ordered, 0.95) * 1000,
+                "max": ordered[-1] * 1000,
+            }
+
+        return {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": self.repeat,
+            "decks": self.decks,
+            "requests": self.requests,
+            "results": stats,
+            "trace": trace.summary(),
+        }
+
+
+def prepareFixtures(tempDir, source=None):
+    # Fixtures are copied, since the poll benchmarks rewrite them
+    fixtureDir = tempDir / "fixtures"
+    if source:
+        fixtureDir.mkdir()
+        for path in source.iterdir():
+            (fixtureDir / path.name).write_bytes(path.read_bytes())
+    else:
+        fixtures.generate(fixtureDir)
+    return fixtureDir
+
+
+def report(results, baseline=None):
+    # Timings in milliseconds, with the change from a baseline run if given
+    header = f"{'benchmark':<26}{'count':>7}{'p50':>10}{'p95':>10}{'max':>10}"
+    if baseline is not None:
+        header += f"{'p50 was':>10}{'change':>9}"
+    lines = [header]
+
+    for name, stats in results["results"].items():
+        line = (
+            f"{name:<26}{stats['count']:>7}"
+            f"{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['max']:>10.2f}"
+        )
+        previous = (baseline or {}).get("results", {}).get(name, None)
+        if previous is not None:
+            change = (stats["p50"] - previous["p50"]) / max(
+                previous["p50"], 1e-9
+            )
+            line += f"{previous['p50']:>10.2f}{change:>+9.1%}"
+        lines.append(line)
+
+    lines.append(f"\n{results['requests']} requests served")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark guardiandeck against a fake deck and stub API"
+    )
+    parser.add_argument(
+        "--fixtures",
+        type=pathlib.Path,
+        help="directory of recorded fixtures (default: generate synthetic)",
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--decks", type=int, default=1, help="number of fake decks to drive"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="seconds of simulated latency added to every response",
+    )
+    parser.add_argument(
+        "--compare", type=pathlib.Path, help="results file to compare with"
+    )
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        tempDir = pathlib.Path(tempDir)
+        installFakeChassis(tempDir / "data")
+
+        fixtureDir = prepareFixtures(tempDir, args.fixtures)
+        server = StubServer(fixtureDir, args.latency).start()
+        config.bungie = server.url
+        trace.reset()
+
+        try:
+            bench = Bench(
+                tempDir / "data", args.repeat, args.verbose, args.decks
+            )
+            bench.measure(fixtureDir, server)
+        finally:
+            server.stop()
+
+    results = bench.results()
+    baseline = None
+    if args.compare:
+        with args.compare.open("r") as baselineFile:
+            baseline = json.load(baselineFile)
+    print(report(results, baseline))
+
+    if not args.no_save:
+        resultsDir.mkdir(exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        resultsPath = resultsDir / f"{stamp}.json"
+        with resultsPath.open("w") as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+        print(f"Saved to {resultsPath}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
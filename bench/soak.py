@@ -0,0 +1,235 @@
+# stdlib imports
+import argparse
+import asyncio
+import datetime
+import json
+import pathlib
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# local imports
+from bench.fakes import installFakeChassis
+import bench.fixtures as fixtures
+from bench.run import Bench, prepareFixtures, resultsDir
+from bench.stub import StubServer
+import guardiandeck.config as config
+from guardiandeck.scheduler import PollScheduler
+import guardiandeck.trace as trace
+
+
+def peakRss():
+    # Kilobytes on Linux, bytes on macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class Soak:
+    def __init__(self, bench, polls, sampleEvery, reselectEvery):
+        self.bench = bench
+        self.polls = polls
+        self.sampleEvery = sampleEvery
+        self.reselectEvery = reselectEvery
+
+        self.count = 0
+        self.cpu = []
+        self.samples = []
+        self.firstSnapshot = None
+        self.lastSnapshot = None
+
+    def sample(self, deck):
+        current, peak = tracemalloc.get_traced_memory()
+        self.samples.append(
+            {
+                "poll": self.count,
+                "traced": current,
+                "tracedPeak": peak,
+                "rss": peakRss(),
+                "subscribers": len(deck.inventorySubscriptions),
+                "frames": sum(len(each._stack) for each in deck.surfaces),
+                "cachedFrames": sum(
+                    len(each.frameCache) for each in deck.surfaces
+                ),
+                "images": deck.imageCache.stats()["items"],
+            }
+        )
+
+        # The first sample is the baseline, taken once everything is warm
+        snapshot = tracemalloc.take_snapshot()
+        if self.firstSnapshot is None:
+            self.firstSnapshot = snapshot
+        self.lastSnapshot = snapshot
+
+    def run(self, deck):
+        original = deck.pollOnce
+        done = self.bench.loop.create_future()
+
+        async def pollOnce():
+            start = time.process_time()
+            changes = await original()
+            self.cpu.append(time.process_time() - start)
+            self.count += 1
+
+            # Leave and re-enter the character screen now and then, like a
+            # user would, so frames are created and destroyed as well
+            if self.reselectEvery and self.count % self.reselectEvery == 0:
+                surface = deck.surfaces[0]
+                await surface.popFrame()
+                await surface.device.press(surface.key(1, 1))
+
+            if self.count % self.sampleEvery == 0:
+                self.sample(deck)
+            if self.count >= self.polls and not done.done():
+                done.set_result(None)
+            return changes
+
+        # Poll back to back through the real loop, as fast as replies come
+        deck.pollOnce = pollOnce
+        deck.pollScheduler = PollScheduler(
+            activeDelay=0, idleDelay=0, maxDelay=0, jitter=0
+        )
+        task = self.bench.loop.create_task(deck.pollInventory())
+        self.bench.run(done)
+        task.cancel()
+        self.bench.run(asyncio.gather(task, return_exceptions=True))
+
+    def results(self):
+        ordered = sorted(self.cpu)
+        growth = []
+        if self.firstSnapshot is not None:
+            for stat in self.lastSnapshot.compare_to(
+                self.firstSnapshot, "lineno"
+            )[:10]:
+                growth.append(
+                    {
+                        "where": str(stat.traceback),
+                        "sizeDiff": stat.size_diff,
+                        "countDiff": stat.count_diff,
+                    }
+                )
+
+        return {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "polls": self.count,
+            "cpu": {
+                "mean": sum(ordered) / len(ordered) * 1000,
+                "p50": trace.percentile(ordered, 0.50) * 1000,
+                "p95": trace.percentile(ordered, 0.95) * 1000,
+                "max": ordered[-1] * 1000,
+            },
+            "samples": self.samples,
+            "growth": growth,
+        }
+
+
+def report(results):
+    cpu = results["cpu"]
+    lines = [
+        f"{results['polls']} polls, CPU per poll (ms): mean {cpu['mean']:.2f}"
+        f"  p50 {cpu['p50']:.2f}  p95 {cpu['p95']:.2f}  max {cpu['max']:.2f}",
+        "",
+        f"{'poll':>8}{'traced KiB':>12}{'peak KiB':>10}{'rss KiB':>10}"
+        f"{'subs':>6}{'frames':>8}{'cached':>8}{'images':>8}",
+    ]
+    for sample in results["samples"]:
+        lines.append(
+            f"{sample['poll']:>8}{sample['traced'] // 1024:>12}"
+            f"{sample['tracedPeak'] // 1024:>10}{sample['rss'] or 0:>10}"
+            f"{sample['subscribers']:>6}{sample['frames']:>8}"
+            f"{sample['cachedFrames']:>8}{sample['images']:>8}"
+        )
+
+    lines += ["", "Largest growth since the first sample:"]
+    for stat in results["growth"]:
+        lines.append(
+            f"{stat['sizeDiff']:>+10} B {stat['countDiff']:>+7}  "
+            f"{stat['where']}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay inventory polls to look for growth over time"
+    )
+    parser.add_argument(
+        "--fixtures",
+        type=pathlib.Path,
+        help="directory of recorded fixtures (default: generate synthetic)",
+    )
+    parser.add_argument("--polls", type=int, default=2000)
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=50,
+        help="length of the synthetic snapshot sequence",
+    )
+    parser.add_argument(
+        "--change-every",
+        type=int,
+        default=5,
+        help="polls between synthetic inventory changes",
+    )
+    parser.add_argument(
+        "--reselect-every",
+        type=int,
+        default=100,
+        help="polls between leaving and re-entering the character (0: never)",
+    )
+    parser.add_argument("--sample-every", type=int, default=200)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        tempDir = pathlib.Path(tempDir)
+        installFakeChassis(tempDir / "data")
+
+        # Recorded fixtures bring their own sequence, if they have one
+        fixtureDir = prepareFixtures(tempDir, args.fixtures)
+        if not args.fixtures:
+            fixtures.writeSequence(fixtureDir, args.steps, args.change_every)
+
+        server = StubServer(fixtureDir).start()
+        config.bungie = server.url
+
+        try:
+            bench = Bench(tempDir / "data", 1, args.verbose)
+            deck = bench.newDeck()
+            bench.startup(deck)
+            surface = deck.surfaces[0]
+            bench.run(surface.device.press(surface.key(1, 1)))
+
+            tracemalloc.start()
+            soak = Soak(
+                bench, args.polls, args.sample_every, args.reselect_every
+            )
+            soak.run(deck)
+            tracemalloc.stop()
+
+            bench.closeDeck(deck)
+        finally:
+            server.stop()
+
+    results = soak.results()
+    print(report(results))
+
+    if not args.no_save:
+        resultsDir.mkdir(exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        resultsPath = resultsDir / f"soak-{stamp}.json"
+        with resultsPath.open("w") as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+        print(f"Saved to {resultsPath}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# stdlib imports
+import collections
+import http.server
+import json
+import pathlib
+import threading
+import time
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive, like the real API, so connection reuse is measured too
+    protocol_version = "HTTP/1.1"
+
+    # Headers and body go out as separate writes, which Nagle would stall
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        # Drain any body (the client sends one even with GETs) so the
+        # connection stays usable
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+
+        server = self.server
+        server.hits[self.command, self.path] += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        route = server.routes.get(f"{self.command} {self.path}", None)
+        if route is None:
+            route = server.routes.get(self.path, None)
+        if route is None:
+            self.send_error(404)
+            return
+
+        # A route with a sequence of files steps through them, one per hit
+        name = route.get("file", None)
+        if name is None:
+            sequence = route["sequence"]
+            hit = server.hits[self.command, self.path] - 1
+            name = sequence[hit % len(sequence)]
+
+        body = (server.fixtureDir / name).read_bytes()
+        status, start = 200, 0
+
+        # Enough Range support for resumed manifest downloads
+        rangeHeader = self.headers.get("Range", None)
+        if rangeHeader and rangeHeader.startswith("bytes="):
+            start = int(rangeHeader[6:].split("-")[0])
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", route.get("type", "application/json"))
+        self.send_header("Content-Length", str(len(body) - start))
+        self.send_header("ETag", route.get("etag", '"bench"'))
+        if status == 206:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+
+class StubServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fixtureDir, latency=0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.fixtureDir = pathlib.Path(fixtureDir)
+        self.latency = latency
+        self.hits = collections.Counter()
+        self.reload()
+
+    def reload(self):
+        # Fixtures can be swapped on disk between phases of a run
+        with (self.fixtureDir / "routes.json").open("r") as routesFile:
+            self.routes = json.load(routesFile)
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,171 @@
+# stdlib imports
+import asyncio
+import concurrent.futures
+import functools
+import json
+import json.decoder
+import threading
+import time
+
+# vendor imports
+from PIL import Image
+
+# local imports
+import guardiandeck.config as config
+import guardiandeck.trace as trace
+
+
+class APIError(Exception):
+    pass
+
+
+class SingleFlight:
+    def __init__(self):
+        # Key -> future of the call currently in flight for it
+        self._inFlight = {}
+
+    async def run(self, key, factory):
+        # Join the identical call already in flight, or else start one
+        future = self._inFlight.get(key, None)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inFlight[key] = future
+            future.add_done_callback(lambda _: self._inFlight.pop(key, None))
+
+        # Shielded, so one caller giving up doesn't cancel it for the others
+        return await asyncio.shield(future)
+
+
+class BungieClient:
+    def __init__(self, apiKey, maxConcurrency=6, timeout=(5, 30)):
+        self.apiKey = apiKey
+        self.timeout = timeout
+        self.maxConcurrency = maxConcurrency
+
+        # The session is created by the first request, so importing requests
+        # (which is slow) doesn't hold up the first frame
+        self._session = None
+        self._sessionLock = threading.Lock()
+
+        # Blocking requests are handed to a bounded pool of workers. The pool
+        # size doubles as the limit on concurrent requests in flight.
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=maxConcurrency, thread_name_prefix="guardiandeck-api"
+        )
+
+        # Monotonic time until which the API asked us to hold off
+        self.throttledUntil = 0
+
+        # Concurrent identical reads share a single request
+        self.flights = SingleFlight()
+
+    @property
+    def session(self):
+        with self._sessionLock:
+            if self._session is None:
+                import requests
+                import requests.adapters
+
+                # One session for every request, so keep-alive connections
+                # are pooled and reused instead of renegotiated on every call
+                self._session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=4, pool_maxsize=self.maxConcurrency
+                )
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+            return self._session
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self._session is not None:
+            self._session.close()
+
+    async def run(self, func, *args, **kwargs):
+        # Run a blocking function on the worker pool and await the result
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def request(self, method, url, **kwargs):
+        # Every request gets a timeout unless the caller asks otherwise
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method.upper(), url, **kwargs)
+
+    def call(self, route, data={}, method="get", strict=False, **kwargs):
+        # Construct the headers
+        headers = {
+            "X-API-Key": self.apiKey,
+            "Authorization": f"Bearer {config.chassis.props.token.get()}",
+            "Content-Type": "application/json",
+        }
+
+        # Make the request
+        with trace.span("api.call"):
+            response = self.request(
+                method,
+                config.bungie + route,
+                headers=headers,
+                data=json.dumps(data),
+                **kwargs,
+            )
+
+        # Rate limiting without a JSON body
+        if response.status_code == 429:
+            retryAfter = response.headers.get("Retry-After", "1")
+            self.throttle(float(retryAfter) if retryAfter.isdigit() else 1)
+
+        # Just return the json. Further functionality may
+        # be needed in the future
+        try:
+            decoded = response.json()
+            errorCode = decoded.get("ErrorCode", 0)
+            self.throttle(decoded.get("ThrottleSeconds", 0))
+
+            # Writes that others act on can ask for errors to be raised
+            if errorCode > 1:
+                if strict:
+                    raise APIError(decoded.get("Message", errorCode))
+                print(f'API ERROR: {decoded.get("Message", errorCode)}')
+
+            return decoded.get("Response", response)
+        except json.decoder.JSONDecodeError:
+            raise APIError(
+                f"Expected JSON data from API. Received {response.status_code}"
+            )
+
+    def throttle(self, seconds):
+        if seconds > 0:
+            self.throttledUntil = max(
+                self.throttledUntil, time.monotonic() + seconds
+            )
+
+    def throttleRemaining(self):
+        return max(self.throttledUntil - time.monotonic(), 0)
+
+    def fetchImage(self, route):
+        # Fetch the image
+        with trace.span("api.image"):
+            response = self.request("get", config.bungie + route, stream=True)
+            response.raise_for_status()
+            fetchedImage = Image.open(response.raw)
+
+            # Load it into memory and return
+            fetchedImage.load()
+            return fetchedImage
+
+    async def callAsync(self, route, data={}, method="get", **kwargs):
+        # Only reads are coalesced; every write has to reach the API
+        if method.lower() != "get" or kwargs:
+            return await self.run(self.call, route, data, method, **kwargs)
+
+        return await self.flights.run(
+            ("get", route, json.dumps(data, sort_keys=True)),
+            lambda: self.run(self.call, route, data, method),
+        )
+
+    async def fetchImageAsync(self, route):
+        return await self.flights.run(
+            ("image", route), lambda: self.run(self.fetchImage, route)
+        )
@@ -0,0 +1,211 @@
+# stdlib imports
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class ImageCache:
+    def __init__(self, maxItems=256, maxBytes=16 * 1024 * 1024):
+        self.maxItems = maxItems
+        self.maxBytes = maxBytes
+
+        # Entries are kept in least- to most-recently used order
+        self._entries = collections.OrderedDict()
+        self.size = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        # Look up the entry and mark it as most recently used
+        value = self._entries.get(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        # Anything too large to ever fit is not worth caching
+        if len(value) > self.maxBytes:
+            return
+
+        # Replace any existing entry for the key
+        if key in self._entries:
+            self.size -= len(self._entries.pop(key))
+        self._entries[key] = value
+        self.size += len(value)
+
+        # Evict least recently used entries until both limits are satisfied
+        while len(self._entries) > self.maxItems or self.size > self.maxBytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "items": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class TileCache:
+    def __init__(self, path, maxBytes, syncInterval=30):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.indexPath = self.path / "index.json"
+        self.maxBytes = maxBytes
+
+        # File name -> size, in least- to most-recently used order
+        self._entries = collections.OrderedDict()
+        self.size = 0
+        self._dirty = False
+
+        # Tiles are read and written from worker threads. The index is only
+        # written every so often (and on exit), not on every new tile.
+        self._lock = threading.Lock()
+        self.syncInterval = syncInterval
+        self._lastSync = time.monotonic()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.load()
+
+    def load(self):
+        # Read back the index, skipping entries whose file has gone missing
+        indexed = collections.OrderedDict()
+        if self.indexPath.exists():
+            try:
+                with self.indexPath.open("r") as indexFile:
+                    entries = json.load(indexFile)["entries"]
+            except (ValueError, KeyError):
+                entries = []
+            for name, size in entries:
+                if (self.path / name).exists():
+                    indexed[name] = size
+
+        # Tiles are only ever moved into place whole, so any written since
+        # the last sync (say the app was killed) are kept too. Nothing is
+        # known about when they were used, so they go first in line for
+        # eviction.
+        for tilePath in self.path.glob("*.tile"):
+            if tilePath.name not in indexed:
+                self._entries[tilePath.name] = tilePath.stat().st_size
+                self._dirty = True
+        self._entries.update(indexed)
+        self.size = sum(self._entries.values())
+
+        # Half written tiles are of no use to anyone
+        for tempPath in self.path.glob("*.tmp"):
+            tempPath.unlink()
+
+        self.evict()
+
+    def sync(self):
+        with self._lock:
+            self._lastSync = time.monotonic()
+            if not self._dirty:
+                return
+
+            tempPath = self.indexPath.with_name(self.indexPath.name + ".tmp")
+            with tempPath.open("w") as indexFile:
+                json.dump({"entries": list(self._entries.items())}, indexFile)
+            os.replace(tempPath, self.indexPath)
+            self._dirty = False
+
+    def fileName(self, key):
+        return (
+            hashlib.blake2b(key.encode("utf8"), digest_size=20).hexdigest()
+            + ".tile"
+        )
+
+    def get(self, key):
+        name = self.fileName(key)
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+
+        try:
+            value = (self.path / name).read_bytes()
+        except OSError:
+            with self._lock:
+                if name in self._entries:
+                    self.size -= self._entries.pop(name)
+                    self._dirty = True
+                self.misses += 1
+            return None
+
+        # Mark the tile as most recently used
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                self._dirty = True
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.maxBytes:
+            return
+
+        # Write the tile under a temporary name and move it into place
+        name = self.fileName(key)
+        tempPath = self.path / (name + f".{threading.get_ident()}.tmp")
+        tempPath.write_bytes(value)
+        os.replace(tempPath, self.path / name)
+
+        with self._lock:
+            if name in self._entries:
+                self.size -= self._entries.pop(name)
+            self._entries[name] = len(value)
+            self.size += len(value)
+            self._dirty = True
+            self.evict()
+            due = time.monotonic() - self._lastSync >= self.syncInterval
+
+        if due:
+            self.sync()
+
+    def evict(self):
+        # Drop least recently used tiles until the cache fits its cap
+        while self.size > self.maxBytes:
+            name, size = self._entries.popitem(last=False)
+            try:
+                (self.path / name).unlink()
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+            self._dirty = True
+
+    def stats(self):
+        return {
+            "items": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,11 +1,11 @@
 # stdlib imports
 import pathlib
+import threading
 
 # vendor imports
 from PIL import ImageFont
 from spgill.util.chassis import Chassis
 
-
 bungie = "https://www.bungie.net"
 
 
@@ -25,10 +25,16 @@ chassis = Chassis(
         # Manifest data
         "manifestVersion": "",
         "manifestContentName": "",
+        # Cache props
+        "tileCacheSize": 32 * 1024 * 1024,
+        # Poll props
+        "pollProfile": False,
         # Player props
         "membershipId": "",
         "membershipType": None,
         "characterId": "",
+        "characters": None,
+        "loadouts": {},
     },
 )
 
@@ -37,3 +43,7 @@ font12 = ImageFont.truetype(
     font=str(chassis.store.root / "assets" / "IBMPlexSans-Regular.ttf"),
     size=12,
 )
+
+# Tiles are drawn on worker threads, and a FreeType face must not be used by
+# more than one of them at a time
+fontLock = threading.Lock()
@@ -1,86 +1,195 @@
 # stdlib imports
 import asyncio
+import concurrent.futures
 import datetime
-import os
+import functools
 import pathlib
 import pprint
 from PIL import Image, ImageDraw
 import hashlib
-import json
-import json.decoder
-import marshal
-import sqlite3
+import signal
 import sys
 import threading
 import time
 import traceback
-import urllib.request
-import uuid
-import webbrowser
-import zipfile
 
 # vendor imports
-import requests
 from StreamDeck.DeviceManager import DeviceManager
-from StreamDeck.ImageHelpers import PILHelper
 
 # local imports
+from guardiandeck.api import APIError, BungieClient, SingleFlight  # noqa: F401
+from guardiandeck.cache import ImageCache, TileCache
 import guardiandeck.config as config
-from guardiandeck.frame import LoadingFrame
-from guardiandeck.stages.CharacterSelection import CharacterSelectionStage
-
-closingImage = Image.new(mode="RGB", size=(72, 72))
-closingImageCanvas = ImageDraw.Draw(closingImage)
-closingImageCanvas.text(
-    (12, 26), "Closing...", fill=(255, 255, 255), font=config.font12
+import guardiandeck.helpers as helpers
+from guardiandeck.inventory import (
+    InventorySnapshot,
+    equipLocally,
+    splitProfileInventories,
 )
-
-
-class APIError(Exception):
-    pass
+from guardiandeck.scheduler import PollScheduler
+import guardiandeck.trace as trace
+from guardiandeck.manifest import Manifest, downloadContent
+from guardiandeck.stages.CharacterSelection import CharacterSelectionStage
+from guardiandeck.surface import DeckSurface
+
+# Character fields kept between runs, so the character screen can be shown
+# before the profile has been fetched again
+snapshotFields = [
+    "characterId",
+    "light",
+    "raceHash",
+    "classHash",
+    "emblemPath",
+]
+
+
+def drawClosingImage():
+    closingImage = Image.new(mode="RGB", size=(72, 72))
+    closingImageCanvas = ImageDraw.Draw(closingImage)
+    with config.fontLock:
+        closingImageCanvas.text(
+            (12, 26), "Closing...", fill=(255, 255, 255), font=config.font12
+        )
+    return closingImage
 
 
 class GuardianDeck:
-    def __init__(self):
+    def __init__(self, deviceManager=None):
+        # Startup milestones are measured from here
+        self.startTime = time.perf_counter()
+        self.milestones = {}
+
         # Gotta make sure there's an API key configured
         self.apiKey = config.chassis.props.apiKey.get()
         if not self.apiKey:
             raise RuntimeError("No API key configured!")
 
         # Instance variables
-        self.apiSession = requests.Session()
-        self.hold1 = False
+        self.api = BungieClient(self.apiKey)
         self.inventorySubscriptions = []
         self.pollStarted = False
+        self.characterId = None
         self.inventoryData = None
-        self.inventoryHash = None
+        self.inventorySnapshot = None
+
+        # Latest inventory and snapshot of every character polled so far.
+        # The two above are those of the selected character.
+        self.inventories = {}
+        self.inventorySnapshots = {}
+
+        # Equips shown before the API confirmed them, and a counter bumped
+        # on every such local change
+        self.pendingEquips = set()
+        self.inventoryGeneration = 0
+        self.pollScheduler = PollScheduler()
+
+        # Polls run one at a time, so each diffs against the snapshot the one
+        # before it left. So do token checks.
+        self.pollLock = asyncio.Lock()
+        self.authLock = asyncio.Lock()
 
         # Icon cache
         self.iconCache = config.chassis.store.path / "cache" / "icons"
         self.iconCache.mkdir(exist_ok=True)
 
-        # Open up a connection to the stream deck
-        self.openDeck()
+        # In-memory cache of key images already in device-native format,
+        # backed by a size-capped cache of the same bytes on disk
+        self.imageCache = ImageCache()
+        self.tileCache = TileCache(
+            config.chassis.store.path / "cache" / "tiles",
+            config.chassis.props.tileCacheSize.get(),
+        )
+
+        # Concurrent loads of the same icon or tile are done once and shared
+        self.imageFlights = SingleFlight()
 
-        # Setup the frame stack
-        self.setupStack()
+        # Image composition and manifest queries run on their own small pool
+        # so the loop stays free for key presses
+        self.workers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="guardiandeck-render"
+        )
 
-        # Ensure auth credentials are still good
-        self.verifyAuth()
+        # Icon prefetching only gets part of the API worker pool, so user
+        # actions are never queued behind it
+        self.prefetchLimit = asyncio.Semaphore(3)
 
-        # Fetch and verify manifest information
-        self.fetchManifestData()
+        # Set once a manifest is open. The character screen can come up from
+        # the saved profile before then, but nothing past it can.
+        self.manifest = None
+        self.manifestReady = asyncio.Event()
 
-        # Fetch the user information (which includes updating auth info)
-        self.fetchUserInfo()
+        # Open up a connection to the stream deck
+        self.deviceManager = deviceManager
+        self.openDeck()
 
-        # Start the event loop
+    def run(self):
+        # Start the event loop (startup continues inside the loop)
         self.startLoop()
 
         # Close the connection to the deck
         self.closeDeck()
 
-    def verifyAuth(self):
+    async def startup(self):
+        try:
+            # Setup the frame stack of every deck
+            await asyncio.gather(
+                *[surface.setupStack() for surface in self.surfaces]
+            )
+            self.recordMilestone("startup.firstFrame")
+
+            # Show the characters from the last run straight away, if there
+            # are any, and bring them up to date once the fresh ones arrive
+            cachedCharacters = self.loadProfileSnapshot()
+            if cachedCharacters:
+                await self.showCharacters(cachedCharacters)
+                self.recordMilestone("startup.interactive")
+
+            # Ensure auth credentials are still good
+            await self.verifyAuth()
+
+            # The manifest and the account lookups don't depend on each
+            # other, so fetch and verify both at the same time
+            _, characters = await asyncio.gather(
+                self.fetchManifestData(), self.fetchUserInfo()
+            )
+
+            if cachedCharacters:
+                await asyncio.gather(
+                    *[
+                        surface.selectionFrame.updateCharacters(characters)
+                        for surface in self.surfaces
+                    ]
+                )
+            else:
+                await self.showCharacters(characters)
+                self.recordMilestone("startup.interactive")
+
+            # Polling the whole profile doesn't need a character, so start
+            # right away and have every character warm by the time one's
+            # chosen
+            if config.chassis.props.pollProfile.get():
+                self.startInventoryPoll()
+        except Exception:
+            print(
+                "Startup failed:\n",
+                "".join(traceback.format_exception(*sys.exc_info())),
+            )
+            self.loop.stop()
+
+    def recordMilestone(self, name):
+        elapsed = time.perf_counter() - self.startTime
+        self.milestones[name] = elapsed
+        trace.record(name, elapsed)
+        print(f"{name} after {elapsed:.2f}s")
+
+    async def verifyAuth(self):
+        # One check at a time, so overlapping callers can't refresh the
+        # token twice or open a second sign in. Whoever waited finds the
+        # token already fresh.
+        async with self.authLock:
+            await self.refreshAuth()
+
+    async def refreshAuth(self):
         # Get and decode the timestamps
         now, tokenExpiration, refreshTokenExpiration = None, None, None
         if config.chassis.props.token.get():
@@ -101,6 +210,10 @@ class GuardianDeck:
         ):
             print("Fetching new token...")
 
+            # Only needed for a full sign in, which is rare
+            import uuid
+            import webbrowser
+
             # Start an authorization request with the spgill server
             authState = str(uuid.uuid4())
             startUrl = f"https://home.spgill.me/bungie/start/{authState}"
@@ -110,13 +223,15 @@ class GuardianDeck:
             tokenData = None
             while not tokenData:
                 print("Polling...")
-                pollResp = requests.get(
-                    url=f"https://home.spgill.me/bungie/poll/{authState}"
+                pollResp = await self.api.run(
+                    self.api.request,
+                    "get",
+                    f"https://home.spgill.me/bungie/poll/{authState}",
                 )
                 if pollResp.status_code != 404:
                     tokenData = pollResp.json()
                     continue
-                time.sleep(0.25)
+                await asyncio.sleep(0.25)
 
             # Store all the token data in the chassis
             self.storeTokenResponse(tokenData)
@@ -127,8 +242,10 @@ class GuardianDeck:
             print("Refreshing token...")
 
             # Ask the server for a refresh
-            refreshResp = requests.get(
-                url=f"https://home.spgill.me/bungie/refresh",
+            refreshResp = await self.api.run(
+                self.api.request,
+                "get",
+                "https://home.spgill.me/bungie/refresh",
                 data={
                     "refresh_token": config.chassis.props.refreshToken.get()
                 },
@@ -136,6 +253,10 @@ class GuardianDeck:
             self.storeTokenResponse(refreshResp.json())
 
     def storeTokenResponse(self, response):
+        # A different account makes the saved profile meaningless
+        if response["membership_id"] != config.chassis.props.bungieId.get():
+            config.chassis.props.characters.set(None)
+
         config.chassis.props.bungieId.set(response["membership_id"])
         config.chassis.props.token.set(response["access_token"])
         config.chassis.props.tokenExpiration.set(
@@ -153,135 +274,197 @@ class GuardianDeck:
         )
         config.chassis.props.sync()
 
-    def apiCall(self, route, data={}, method="get", **kwargs):
-        # Construct the headers
-        headers = {
-            "X-API-Key": self.apiKey,
-            "Authorization": f"Bearer {config.chassis.props.token.get()}",
-            "Content-Type": "application/json",
-        }
-
-        # Make the request
-        response = getattr(self.apiSession, method.lower())(
-            url=config.bungie + route,
-            headers=headers,
-            data=json.dumps(data),
-            **kwargs,
-        )
-
-        # Just return the json. Further functionality may
-        # be needed in the future
-        try:
-            decoded = response.json()
-            errorCode = decoded.get("ErrorCode", 0)
-
-            if errorCode > 1:
-                print(f'API ERROR: {decoded.get("Message", errorCode)}')
+    async def apiCall(self, route, data={}, method="get", **kwargs):
+        return await self.api.callAsync(route, data, method, **kwargs)
 
-            return decoded.get("Response", response)
-        except json.decoder.JSONDecodeError:
-            raise APIError(
-                f"Expected JSON data from API. Received {response.status_code}"
-            )
+    async def fetchImage(self, route):
+        return await self.api.fetchImageAsync(route)
 
-    def fetchImage(self, route):
-        # Fetch the image
-        fetchedImage = Image.open(
-            requests.get(url=config.bungie + route, stream=True).raw
+    async def offload(self, func, *args, **kwargs):
+        # Run rendering or data access work on the worker pool
+        return await self.loop.run_in_executor(
+            self.workers, functools.partial(func, *args, **kwargs)
         )
 
-        # Load it into memory and return
-        fetchedImage.load()
-        return fetchedImage
-
-    def prepareImage(self, image):
-        # Just convert to RGB and pass through the helper
-        return PILHelper.to_native_format(self.device, image.convert("RGB"))
+    def openImage(self, path):
+        # Open and fully decode, so nothing is left to do lazily on the loop
+        with trace.span("image.decode"):
+            image = Image.open(path)
+            image.load()
+            return image
 
-    def fetchCachedImage(self, route):
+    def cachedImagePath(self, route):
         # Hash the image route to create a unique file path
         routeHash = hashlib.blake2b(
             route.encode("utf8"), digest_size=24
         ).hexdigest()
-        hashedPath = self.iconCache / f"{routeHash}.png"
+        return self.iconCache / f"{routeHash}.png"
+
+    async def fetchCachedImage(self, route):
+        return await self.imageFlights.run(
+            ("icon", route), lambda: self.loadCachedImage(route)
+        )
+
+    async def loadCachedImage(self, route):
+        hashedPath = self.cachedImagePath(route)
 
         # If the file already exists, load it
         if hashedPath.exists():
-            return Image.open(hashedPath)
+            return await self.offload(self.openImage, hashedPath)
 
         # Else, fetch it and create it
         else:
-            imageData = self.fetchImage(route)
-            imageData.save(hashedPath)
+            imageData = await self.fetchImage(route)
+            await self.offload(imageData.save, hashedPath)
             return imageData
 
-    def fetchManifestData(self):
+    async def prefetchImage(self, route):
+        async with self.prefetchLimit:
+            try:
+                await self.fetchCachedImage(route)
+            except Exception as err:
+                print(f"Prefetch of {route} failed: {err}")
+
+    async def prefetchInventoryIcons(self, inventoryData):
+        # Collect the icon of every equipped and carried item, along with the
+        # ammo icons every weapon tile uses
+        items = (
+            inventoryData["equipment"]["data"]["items"]
+            + inventoryData["inventory"]["data"]["items"]
+        )
+        itemInfos = await self.queryItems([item["itemHash"] for item in items])
+        routes = {itemInfo.icon for itemInfo in itemInfos.values()}
+        routes.update(helpers.ammoIconRoutes.values())
+
+        # Fetch everything that isn't on disk yet, a few at a time
+        missing = [
+            route
+            for route in routes
+            if route and not self.cachedImagePath(route).exists()
+        ]
+        if missing:
+            print(f"Prefetching {len(missing)} icons...")
+            await asyncio.gather(*[self.prefetchImage(r) for r in missing])
+
+    async def loadTile(self, cacheKey, render):
+        # Try the disk tier, and only render as a last resort
+        diskKey = repr(cacheKey)
+        tile = await self.offload(self.tileCache.get, diskKey)
+        if tile is None:
+            tile = await render()
+            await self.offload(self.tileCache.put, diskKey, tile)
+
+        self.imageCache.put(cacheKey, tile)
+        return tile
+
+    async def fetchManifestData(self):
         print("Fetching manifest data...")
-        self.manifestData = self.apiCall(f"/Platform/Destiny2/Manifest/")
+        self.manifestData = await self.apiCall("/Platform/Destiny2/Manifest/")
         version = self.manifestData["version"]
 
         # Make sure the cache dir exists
-        cachePath = config.chassis.store.path / "cache"
-        cachePath.mkdir(exist_ok=True)
+        self.manifestCache = config.chassis.store.path / "cache"
+        self.manifestCache.mkdir(exist_ok=True)
+
+        # Open whichever manifest is already installed
+        installedVersion = config.chassis.props.manifestVersion.get()
+        installedName = config.chassis.props.manifestContentName.get()
+        if installedName and (self.manifestCache / installedName).exists():
+            self.manifest = await self.api.run(
+                self.openManifest, installedVersion, installedName
+            )
 
         # Check the version
-        if version != config.chassis.props.manifestVersion.get():
+        if version != installedVersion:
             print("Cached manifest data is out-of-date or missing")
-            print("Reconstructing manifest cache...")
-
-            # Fetch and decompress content file
-            archivePath = cachePath / f"mwcp.{version}.zip"
-            urllib.request.urlretrieve(
-                config.bungie
-                + self.manifestData["mobileWorldContentPaths"]["en"],
-                archivePath,
-            )
-            with zipfile.ZipFile(archivePath) as archive:
-                contentInfo = archive.infolist()[0]
-                config.chassis.props.manifestContentName.set(
-                    contentInfo.filename
-                )
-                archive.extract(contentInfo, path=cachePath)
-            os.remove(archivePath)
 
-            # Update stored manifest version
-            config.chassis.props.manifestVersion.set(version)
-            print("Done!")
+            # With nothing to serve from, the new version has to be waited
+            # on. Otherwise keep using the old one until the new one is ready.
+            if self.manifest is None:
+                await self.installManifest(version)
+            else:
+                self.loop.create_task(self.updateManifest(version))
+
+        self.manifestReady.set()
 
+    def openManifest(self, version, contentName):
         # Open a connection to the content database
-        manifestContentPath = (
-            cachePath / config.chassis.props.manifestContentName.get()
-        )
-        self.manifestContent = sqlite3.connect(
-            f"file:{manifestContentPath}?mode=ro",
-            uri=True,
-            check_same_thread=False,
+        manifest = Manifest(self.manifestCache / contentName)
+
+        # Load (or build, on the first run of a version) the derived indexes
+        manifest.loadIndexes(self.manifestCache / f"indexes.{version}.json")
+
+        # Same for the slim store of the fields used while rendering
+        manifest.loadProjection(
+            self.manifestCache / f"projection.{version}.sqlite3"
         )
 
-        self.manifestGet("DestinyRaceDefinition", "2803282938")
+        manifest.get("DestinyRaceDefinition", "2803282938")
+        return manifest
 
-    def manifestGet(self, table, hash):
-        # Convert has to ID
-        id = int(hash)
-        if (id & (1 << (32 - 1))) != 0:
-            id = id - (1 << 32)
+    async def installManifest(self, version):
+        print("Reconstructing manifest cache...")
 
-        cursor = self.manifestContent.execute(
-            f"SELECT json FROM {table} WHERE id={id}"
+        # Stream, decompress and verify the content file off of the loop
+        # thread, then open it and build its indexes the same way
+        contentName = await self.api.run(
+            downloadContent,
+            self.api.request,
+            config.bungie + self.manifestData["mobileWorldContentPaths"]["en"],
+            self.manifestCache,
         )
+        manifest = await self.api.run(self.openManifest, version, contentName)
 
-        found = cursor.fetchone()[0]
+        # Swap the new manifest in
+        previous, self.manifest = self.manifest, manifest
 
-        return json.loads(found)
+        # Update stored manifest version
+        config.chassis.props.manifestVersion.set(version)
+        config.chassis.props.manifestContentName.set(contentName)
+        config.chassis.props.sync()
+
+        # Retire the previous manifest along with anything derived from it
+        if previous is not None:
+            await self.offload(previous.close)
+            if previous.path != manifest.path:
+                try:
+                    previous.path.unlink()
+                except FileNotFoundError:
+                    pass
+        keep = [f"indexes.{version}.json", f"projection.{version}.sqlite3"]
+        for pattern in ["indexes.*.json", "projection.*.sqlite3"]:
+            for stalePath in self.manifestCache.glob(pattern):
+                if stalePath.name not in keep:
+                    stalePath.unlink()
+
+        print("Done!")
+
+    async def updateManifest(self, version):
+        # A failed background update just leaves the old manifest in use
+        try:
+            await self.installManifest(version)
+        except Exception:
+            print(
+                "Manifest update failed:\n",
+                "".join(traceback.format_exception(*sys.exc_info())),
+            )
+
+    async def queryItems(self, hashes):
+        await self.manifestReady.wait()
+        return await self.offload(self.manifest.getItems, hashes)
 
-    def manifestGetAll(self, table):
-        for row in self.manifestContent.execute(f"SELECT json FROM {table}"):
-            yield json.loads(row[0])
+    async def queryItem(self, hash):
+        await self.manifestReady.wait()
+        return await self.offload(self.manifest.getItem, hash)
 
-    def fetchUserInfo(self):
+    async def queryName(self, table, hash):
+        await self.manifestReady.wait()
+        return await self.offload(self.manifest.getName, table, hash)
+
+    async def fetchUserInfo(self):
         # Request the bungie net user info
         bungieId = config.chassis.props.bungieId.get()
-        player = self.apiCall(
+        player = await self.apiCall(
             f"/Platform/User/GetMembershipsById/{bungieId}/0/"
         )
 
@@ -289,9 +472,11 @@ class GuardianDeck:
         membership = player["destinyMemberships"][0]
         self.membershipId = membership["membershipId"]
         self.membershipType = membership["membershipType"]
+        config.chassis.props.membershipId.set(self.membershipId)
+        config.chassis.props.membershipType.set(self.membershipType)
 
         # Request the player's destiny profile
-        profile = self.apiCall(
+        profile = await self.apiCall(
             f"/Platform/Destiny2/{self.membershipType}/Profile/{self.membershipId}/?components=200"
         )
 
@@ -306,56 +491,145 @@ class GuardianDeck:
         #     )
         #     self.characterId = characterId
 
+        # Start on the emblems while the manifest may still be loading
+        for character in characters.values():
+            self.loop.create_task(self.prefetchImage(character["emblemPath"]))
+
+        self.storeProfileSnapshot(characters)
+        return characters
+
+    def loadProfileSnapshot(self):
+        # The membership and characters seen on the last run, if any
+        characters = config.chassis.props.characters.get()
+        if not characters or not config.chassis.props.membershipId.get():
+            return None
+
+        self.membershipId = config.chassis.props.membershipId.get()
+        self.membershipType = config.chassis.props.membershipType.get()
+        return characters
+
+    def storeProfileSnapshot(self, characters):
+        # Only what the character screen shows is worth keeping
+        config.chassis.props.characters.set(
+            {
+                characterId: {
+                    field: character[field]
+                    for field in snapshotFields
+                    if field in character
+                }
+                for characterId, character in characters.items()
+            }
+        )
+        config.chassis.props.sync()
+
+    async def showCharacters(self, characters):
+        await asyncio.gather(
+            *[
+                self.showSurfaceCharacters(surface, characters)
+                for surface in self.surfaces
+            ]
+        )
+
+    async def showSurfaceCharacters(self, surface, characters):
         # Remove the loading frame and then push the character selection frame
-        self.popFrame()
-        self.pushFrame(CharacterSelectionStage, {"characters": characters})
+        await surface.popFrame()
+        await surface.pushFrame(
+            CharacterSelectionStage, {"characters": characters}
+        )
+        surface.selectionFrame = surface._stack[0]
+
+    async def redrawInventory(self, subscriptions):
+        # Have these subscribers draw everything again, not just a change
+        try:
+            await asyncio.gather(*[cb() for cb in subscriptions])
+        except Exception:
+            print(
+                "Redraw failed:\n",
+                "".join(traceback.format_exception(*sys.exc_info())),
+            )
 
+    def selectCharacter(self, characterId, character):
+        # The chosen character is shared by every deck, since there is only
+        # the one poller. Whatever the other decks show of the previous one
+        # has to be drawn again in full. Frames set up after this draw the
+        # new one anyway.
+        if characterId != self.characterId:
+            self.loop.create_task(
+                self.redrawInventory(list(self.inventorySubscriptions))
+            )
+        self.characterId = characterId
+        self.character = character
+
+        # Whatever is known of this character's inventory can be shown now,
+        # and the next poll brings it up to date
+        self.inventoryData = self.inventories.get(characterId, None)
+        self.inventorySnapshot = self.inventorySnapshots.get(characterId, None)
+        self.pendingEquips.clear()
+        config.chassis.props.characterId.set(characterId)
         config.chassis.props.sync()
+        self.startInventoryPoll()
 
     def openDeck(self):
-        # Create a manager
-        self.deviceManager = DeviceManager()
+        # Create a manager, unless one was supplied
+        if self.deviceManager is None:
+            self.deviceManager = DeviceManager()
         decks = self.deviceManager.enumerate()
 
+        # Open and reset every deck with keys that can show images, and
+        # give each its own surface to draw on
+        self.surfaces = []
+        for device in decks:
+            # Decks without key displays (like the Pedal) report a key size
+            # of (0, 0), so skip them before they're even opened
+            size = device.key_image_format().get("size", None) or (0, 0)
+            if not size[0]:
+                continue
+            device.open()
+            device.reset()
+            try:
+                self.surfaces.append(DeckSurface(self, device))
+            except RuntimeError as err:
+                print(f"Skipping deck: {err}")
+                device.close()
+
         # If there are no decks, throw an error
-        if len(decks) < 1:
+        if len(self.surfaces) < 1:
             raise RuntimeError("No Stream Decks detected :(")
 
-        # Capture the first deck, open it, and reset it
-        self.device = decks[0]
-        self.device.open()
-        self.device.reset()
-
     def closeDeck(self):
-        self.device.close()
+        for surface in self.surfaces:
+            surface.device.close()
 
     def cleanExit(self):
         # Insert the closing image
-        self.device.set_key_image(
-            self.key(2, 1), self.prepareImage(closingImage)
-        )
+        closingImage = drawClosingImage()
+        for surface in self.surfaces:
+            surface.device.set_key_image(
+                surface.key(2, 1), surface.prepareImage(closingImage)
+            )
+            surface._keyHashes[surface.key(2, 1)] = False
         time.sleep(1)
 
-        # Go through and destroy each frame in the stack
-        for frame in self._stack:
-            frame.setActive(False)
-            frame.destroy()
+        # Go through and destroy each frame in the stacks
+        for surface in self.surfaces:
+            surface.destroyStack()
+
+        # Save the disk tile cache's usage order
+        self.tileCache.sync()
+
+        # Leave the latency stats of this session behind
+        self.dumpTrace()
 
-        # Reset the deck and close the connection
-        self.device.reset()
+        # Reset the decks and close the connections
+        for surface in self.surfaces:
+            surface.device.reset()
         self.closeDeck()
+        self.api.close()
+        self.workers.shutdown(wait=False)
 
         print("Exiting...")
         exit()
 
-    def key(self, x, y):
-        return (y * 5) + x
-
-    def coords(self, n):
-        x = n % 5
-        y = (n - x) // 5
-        return (x, y)
-
     def startLoop(self):
         # try:
         #     while True:
@@ -386,10 +660,20 @@ class GuardianDeck:
         # Create async loop
         self.loop = asyncio.get_event_loop()
 
-        # Add key callback to the loop
-        self.device.set_key_callback_async(self.pressStack, loop=self.loop)
+        # Add key callbacks to the loop
+        for surface in self.surfaces:
+            surface.device.set_key_callback_async(
+                surface.pressStack, loop=self.loop
+            )
+
+        # Latency stats can be dumped at any time with SIGUSR1
+        try:
+            self.loop.add_signal_handler(signal.SIGUSR1, self.dumpTrace)
+        except (AttributeError, NotImplementedError):
+            pass
 
-        # Add inventory poller to the loop
+        # Add the startup sequence and inventory poller to the loop
+        self.loop.create_task(self.startup())
         self.loop.create_task(self.pollInventory())
 
         # Run the loop until stopped
@@ -398,88 +682,14 @@ class GuardianDeck:
         print("Loop stopped")
         self.cleanExit()
 
-    def renderStack(self):
-        # If the stack is empty, zero out all keys to black
-        if len(self._stack) == 0:
-            for x in range(5):
-                for y in range(3):
-                    self.device.set_key_image(
-                        self.key(x, y), self.device.BLANK_KEY_IMAGE
-                    )
-
-        # Else, loop through the top-most stack and render its keys
-        else:
-            frame = self._stack[0]
-            for x in range(5):
-                for y in range(3):
-                    # self.device.set_key_image(self.key(x, y), frame.keys[x][y])
-                    keyNo = self.key(x, y)
-                    value = frame.keys[x][y]
-
-                    # If the value is null, black out the key
-                    if value is None:
-                        self.device.set_key_image(
-                            keyNo, self.device.BLANK_KEY_IMAGE
-                        )
-
-                    # If the value is a string, try and download from a url
-                    if isinstance(value, str):
-                        self.device.set_key_image(
-                            keyNo,
-                            self.prepareImage(self.fetchCachedImage(value)),
-                        )
-
-                    # Else try and directly transfer the value
-                    else:
-                        self.device.set_key_image(keyNo, value)
-
-    def setupStack(self):
-        self._stack = []
-        # self.renderStack()
-        self.pushFrame(LoadingFrame)
-
-    async def pressStack(self, deck, key, state):
-        # Check for exit conditions
-        if key == self.key(0, 2):
-            self.hold1 = state
-        elif key == self.key(0, 0) and self.hold1:
-            self.loop.stop()
+    def dumpTrace(self):
+        trace.dump(config.chassis.store.path / "trace.json")
 
-        if state is False:
-            if len(self._stack):
-                try:
-                    await self._stack[0].press(*self.coords(key))
-                except Exception:
-                    print(
-                        "Unexpected error:\n",
-                        "".join(traceback.format_exception(*sys.exc_info())),
-                    )
-
-    def pushFrame(self, frameClass, frameOptions={}):
-        # Mark the current top frame as inactive
-        if len(self._stack) > 0:
-            self._stack[0].setActive(False)
-
-        # Create instance of the new frame and push it to the stack
-        instance = frameClass(self, True, frameOptions)
-        self._stack.insert(0, instance)
-        instance.setup()
-
-        self.renderStack()
-
-    def popFrame(self):
-        if len(self._stack):
-            # Pop out the top frame, deactivate it, and destroy it
-            frame = self._stack.pop(0)
-            frame.setActive(False)
-            frame.destroy()
-            del frame
-
-            # If there's a frame left, set it as active
-            if len(self._stack):
-                self._stack[0].setActive(True)
-
-            self.renderStack()
+    async def refreshInventory(self):
+        # Poll right now, outside of the schedule, after a change we made
+        changes = await self.pollOnce()
+        self.pollScheduler.record(bool(changes))
+        return changes
 
     def startInventoryPoll(self):
         self.pollStarted = True
@@ -498,34 +708,130 @@ class GuardianDeck:
 
     async def pollInventory(self):
         await self.waitForPollStart()
+        await self.manifestReady.wait()
 
         print("Poll has started")
 
         while True:
             try:
-                # Get the character inventory
-                self.verifyAuth()
-                self.inventoryData = self.apiCall(
-                    f"/Platform/Destiny2/{self.membershipType}/Profile/{self.membershipId}/Character/{self.characterId}/?components=201,205,300"
-                )
+                changes = await self.pollOnce()
+                self.pollScheduler.record(bool(changes))
+
+            except Exception as err:
+                print(err)
+                self.pollScheduler.record(False)
 
-                # Hash the data
-                currentHash = hashlib.blake2b(
-                    marshal.dumps(self.inventoryData)
-                ).hexdigest()
+            # Wait until next poll, respecting any throttling the API asked for
+            self.pollScheduler.throttle(self.api.throttleRemaining())
+            await self.pollScheduler.wait()
 
-                print("checking hash")
-                # If the hash has changed, then update the stored data
-                if currentHash != self.inventoryHash:
-                    self.inventoryHash = currentHash
+    async def fetchInventories(self):
+        await self.verifyAuth()
+        profilePath = f"/Platform/Destiny2/{self.membershipType}/Profile/{self.membershipId}"
 
-                    # Call all of the callback functions and await them
-                    await asyncio.gather(
-                        *[cb() for cb in self.inventorySubscriptions]
-                    )
+        # Every character in one request, or just the selected one
+        if config.chassis.props.pollProfile.get():
+            profileData = await self.apiCall(
+                f"{profilePath}/?components=201,205,300"
+            )
+            return splitProfileInventories(profileData)
 
-            except Exception as err:
-                print(err)
+        inventoryData = await self.apiCall(
+            f"{profilePath}/Character/{self.characterId}/?components=201,205,300"
+        )
+        return {self.characterId: inventoryData}
+
+    async def equipLocally(self, itemInstanceIds):
+        # Show equips the API accepted straight away, rather than after the
+        # next poll. That poll then confirms them, or puts things back.
+        if not itemInstanceIds or self.inventoryData is None:
+            return
+
+        self.inventoryGeneration += 1
+        self.pendingEquips.update(itemInstanceIds)
+
+        inventoryData = equipLocally(self.inventoryData, itemInstanceIds)
+        snapshot = InventorySnapshot(inventoryData)
+        changes = snapshot.diff(self.inventorySnapshot)
+        self.inventories[self.characterId] = self.inventoryData = inventoryData
+        self.inventorySnapshots[self.characterId] = snapshot
+        self.inventorySnapshot = snapshot
+
+        if changes:
+            await asyncio.gather(
+                *[cb(changes) for cb in self.inventorySubscriptions]
+            )
 
-            # Wait until next poll
-            await asyncio.sleep(5)
+    async def pollOnce(self):
+        # Scheduled polls and refreshes after our own changes take turns
+        async with self.pollLock:
+            return await self.checkInventories()
+
+    async def checkInventories(self):
+        with trace.span("poll"):
+            # Get the character inventories
+            generation = self.inventoryGeneration
+            inventories = await self.fetchInventories()
+
+            # A response to a request sent before a local change may not
+            # include it yet, so leave that character to the next poll
+            if self.inventoryGeneration != generation:
+                inventories.pop(self.characterId, None)
+
+            # Compare each against its last snapshot, item by item
+            changed = {}
+            for characterId, inventoryData in inventories.items():
+                snapshot = InventorySnapshot(inventoryData)
+                characterChanges = snapshot.diff(
+                    self.inventorySnapshots.get(characterId, None)
+                )
+                self.inventories[characterId] = inventoryData
+                self.inventorySnapshots[characterId] = snapshot
+                if characterChanges:
+                    changed[characterId] = characterChanges
+
+            # Nothing is shown until a character is chosen
+            characterId = self.characterId
+            if characterId not in self.inventories:
+                self.loop.create_task(self.warmInventoryIcons(list(changed)))
+                return []
+            self.inventoryData = self.inventories[characterId]
+            self.inventorySnapshot = self.inventorySnapshots[characterId]
+            changes = changed.get(characterId, [])
+
+            # Whatever was shown early is now either confirmed or, through
+            # the changes just found, rolled back
+            if self.pendingEquips and characterId in inventories:
+                rejected = [
+                    itemInstanceId
+                    for itemInstanceId in self.pendingEquips
+                    if not self.inventorySnapshot.isEquipped(itemInstanceId)
+                ]
+                if rejected:
+                    print(f"Rolling back {len(rejected)} unconfirmed equips")
+                self.pendingEquips.clear()
+
+            print("checking changes")
+            # If anything changed, then let the subscribers know what
+            if changes:
+                # Call all of the callback functions and await them
+                await asyncio.gather(
+                    *[cb(changes) for cb in self.inventorySubscriptions]
+                )
+
+            self.loop.create_task(self.warmInventoryIcons(list(changed)))
+            return changes
+
+    async def warmInventoryIcons(self, characterIds):
+        # Get the icons any bucket menu could need onto disk, for every
+        # character that changed. It runs in the background, after the
+        # subscribers drew what they need, so it never holds them up.
+        try:
+            await asyncio.gather(
+                *[
+                    self.prefetchInventoryIcons(self.inventories[characterId])
+                    for characterId in characterIds
+                ]
+            )
+        except Exception as err:
+            print(f"Icon prefetch failed: {err}")
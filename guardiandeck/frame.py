@@ -15,10 +15,16 @@ class InteractionFrame:
         # Create empty grid structure for keys
         self.keys = [[None for y in range(3)] for x in range(5)]
 
+    @classmethod
+    def cacheKey(cls, deck, options):
+        # Frames that can be reused between pushes return what their content
+        # depends on here. None means a fresh frame every time.
+        return None
+
     def setActive(self, flag):
         self.active = flag
 
-    def setup(self):
+    async def setup(self):
         pass
 
     def destroy(self):
@@ -29,12 +35,16 @@ class InteractionFrame:
 
 
 class LoadingFrame(InteractionFrame):
-    def setup(self):
+    async def setup(self):
         tile = Image.new(mode="RGB", size=(72, 72))
         canvas = ImageDraw.Draw(tile)
 
-        canvas.text(
-            (12, 26), "Loading...", fill=(255, 255, 255), font=config.font12
-        )
+        with config.fontLock:
+            canvas.text(
+                (12, 26),
+                "Loading...",
+                fill=(255, 255, 255),
+                font=config.font12,
+            )
 
         self.keys[2][1] = self.deck.prepareImage(tile)
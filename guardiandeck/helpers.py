@@ -1,8 +1,13 @@
+# stdlib imports
+import collections
+import threading
+
 # vendor imports
 from PIL import Image, ImageDraw
 
 # local imports
 import guardiandeck.config as config
+import guardiandeck.trace as trace
 
 damageColors = [
     ("#aeaeaeb4", "black"),  # kinetic
@@ -18,48 +23,164 @@ ammoIconRoutes = {
 }
 
 
-def generateItemIcon(deck, inventoryData, item):
-    # Fetch the item info from the manafest
-    itemInfo = deck.manifestGet(
-        "DestinyInventoryItemDefinition", item["itemHash"]
-    )
+# Decoded icons scaled to tile size, by route. Bounded, since every item
+# icon ever seen would otherwise stay here.
+maxIconLayers = 128
+iconLayers = collections.OrderedDict()
 
-    # Get the item instance info
-    itemInstanceInfo = inventoryData["itemComponents"]["instances"]["data"][
-        item["itemInstanceId"]
-    ]
+# Damage box, ammo box and ammo badge merged into one overlay, by
+# (damage type, ammo type)
+overlayLayers = {}
 
-    # Start with the item icon
-    tile = deck.fetchCachedImage(itemInfo["displayProperties"]["icon"]).resize(
-        (72, 72), resample=Image.LANCZOS
-    )
-    canvas = ImageDraw.Draw(tile, "RGBA")
+# Power digit masks and advances, by foreground color
+glyphStrips = {}
 
-    # print("INSTANCE", itemInstanceInfo)
-    [bgColor, fgColor] = damageColors[
-        max(itemInstanceInfo["damageType"] - 1, 0)
-    ]
+# Tiles are composed on worker threads
+layerLock = threading.Lock()
 
-    # Draw a box over the bottom
-    canvas.rectangle((0, 56, 50, 72), fill=bgColor)
-    canvas.text(
-        (4, 54),
-        str(itemInstanceInfo["primaryStat"]["value"]),
-        fill=fgColor,
-        font=config.font12,
-    )
 
-    # Paste the ammo type icon
-    canvas.rectangle((50, 56, 72, 72), fill="#323232")
-    ammoIcon = (
-        deck.fetchCachedImage(
-            ammoIconRoutes[itemInfo["equippingBlock"]["ammoType"]]
+def composeItemTile(
+    deck, icon, ammoIcon, damageType, power, iconRoute=None, ammoType=None
+):
+    with trace.span("render.itemTile"):
+        tile = drawItemTile(
+            icon, ammoIcon, damageType, power, iconRoute, ammoType
         )
-        .resize((20, 20), resample=Image.LANCZOS)
-        .convert("RGBA")
-    )
+    return deck.prepareImage(tile)
+
+
+def drawItemTile(
+    icon, ammoIcon, damageType, power, iconRoute=None, ammoType=None
+):
+    # Everything but the power number is built once and reused, so a tile
+    # is a copy, one composite and a few glyph pastes
+    [bgColor, fgColor] = damageColors[max(damageType - 1, 0)]
+    tile = iconLayer(icon, iconRoute).copy()
+    tile.alpha_composite(overlayLayer(ammoIcon, damageType, ammoType))
+
+    # Drawing on an icon that has alpha of its own always replaced the box
+    # instead of tinting through it, and tiles should look the same no
+    # matter when they were made
+    if icon.mode == "RGBA":
+        tile.paste(bgColor, (0, 56, 50, 72))
+
+    # Stamp the power level one digit at a time
+    masks, advances = glyphStrip(fgColor)
+    x = 4
+    for digit in str(power):
+        tile.paste(fgColor, (round(x), 54), masks[digit])
+        x += advances[digit]
+
+    return tile
+
+
+def iconLayer(icon, route=None):
+    with layerLock:
+        layer = iconLayers.get(route, None) if route else None
+        if layer is not None:
+            iconLayers.move_to_end(route)
+            return layer
+
+    layer = icon.resize((72, 72), resample=Image.LANCZOS).convert("RGBA")
+
+    if route:
+        with layerLock:
+            iconLayers[route] = layer
+            while len(iconLayers) > maxIconLayers:
+                iconLayers.popitem(last=False)
+    return layer
+
+
+def overlayLayer(ammoIcon, damageType, ammoType=None):
+    key = (damageType, ammoType)
+    with layerLock:
+        layer = overlayLayers.get(key, None) if ammoType else None
+    if layer is not None:
+        return layer
 
-    tile.paste(ammoIcon, (52, 54), ammoIcon)
-    # tile.alpha_composite(ammoIcon, (0, 0))
+    bgColor = damageColors[max(damageType - 1, 0)][0]
+    layer = Image.new("RGBA", (72, 72))
 
+    # Box over the bottom, tinted by damage type
+    strip = Image.new("RGBA", (72, 72))
+    ImageDraw.Draw(strip).rectangle((0, 56, 50, 72), fill=bgColor)
+    layer.alpha_composite(strip)
+
+    # The ammo type icon, on a box of its own
+    ImageDraw.Draw(layer).rectangle((50, 56, 72, 72), fill="#323232")
+    badge = ammoIcon.resize((20, 20), resample=Image.LANCZOS).convert("RGBA")
+    layer.alpha_composite(badge, (52, 54))
+
+    if ammoType:
+        with layerLock:
+            overlayLayers[key] = layer
+    return layer
+
+
+def glyphStrip(fgColor):
+    with layerLock:
+        strip = glyphStrips.get(fgColor, None)
+    if strip is not None:
+        return strip
+
+    # One coverage mask per digit, drawn exactly as ImageDraw.text would
+    # place it, plus how far each one advances the pen
+    masks, advances = {}, {}
+    with config.fontLock:
+        height = config.font12.getbbox("0123456789")[3]
+        for digit in "0123456789":
+            advance = config.font12.getlength(digit)
+            mask = Image.new("L", (int(advance) + 2, height))
+            ImageDraw.Draw(mask).text(
+                (0, 0), digit, fill=255, font=config.font12
+            )
+            masks[digit] = mask
+            advances[digit] = advance
+
+    with layerLock:
+        glyphStrips[fgColor] = (masks, advances)
+    return masks, advances
+
+
+def composeLabelTile(deck, text, background=(50, 50, 50)):
+    # A plain tile with a line or two of text on it
+    tile = Image.new("RGB", (72, 72), background)
+    with config.fontLock:
+        ImageDraw.Draw(tile).multiline_text(
+            (8, 20), text, fill=(255, 255, 255), font=config.font12
+        )
     return deck.prepareImage(tile)
+
+
+async def generateItemIcon(deck, inventoryData, item):
+    # Fetch the item info from the manafest
+    itemInfo = await deck.queryItem(item["itemHash"])
+
+    # Get the item instance info
+    itemInstanceInfo = inventoryData["itemComponents"]["instances"]["data"][
+        item["itemInstanceId"]
+    ]
+    damageType = itemInstanceInfo["damageType"]
+    power = itemInstanceInfo["primaryStat"]["value"]
+
+    async def render():
+        # Load both images, then compose the tile off of the loop thread
+        icon = await deck.fetchCachedImage(itemInfo.icon)
+        ammoIcon = await deck.fetchCachedImage(
+            ammoIconRoutes[itemInfo.ammoType]
+        )
+        return await deck.offload(
+            composeItemTile,
+            deck,
+            icon,
+            ammoIcon,
+            damageType,
+            power,
+            itemInfo.icon,
+            itemInfo.ammoType,
+        )
+
+    # The finished tile only depends on these, so it can be reused from cache
+    return await deck.fetchTile(
+        ("item", itemInfo.icon, itemInfo.ammoType, damageType, power), render
+    )
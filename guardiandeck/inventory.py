@@ -0,0 +1,158 @@
+# stdlib imports
+import collections
+
+# A single difference between two inventory snapshots. `kind` is one of;
+#   "equipped"  the item equipped in `bucketHash` is a different one
+#   "carried"   the items carried in `bucketHash` were added/removed/moved
+#   "instance"  the state (power, damage type, ...) of an item changed
+Change = collections.namedtuple(
+    "Change", ["kind", "bucketHash", "itemInstanceId"]
+)
+
+
+def itemKey(item):
+    # Instanced items are identified by instance, everything else by stack
+    return item.get("itemInstanceId", None) or (
+        item["itemHash"],
+        item.get("quantity", 1),
+    )
+
+
+class InventorySnapshot:
+    def __init__(self, inventoryData):
+        # Bucket hash -> instance ID of the equipped item
+        self.equipped = {}
+        for item in inventoryData["equipment"]["data"]["items"]:
+            self.equipped[item["bucketHash"]] = item.get("itemInstanceId")
+
+        # Bucket hash -> keys of every carried item, in order
+        self.carried = collections.defaultdict(list)
+        for item in inventoryData["inventory"]["data"]["items"]:
+            self.carried[item["bucketHash"]].append(itemKey(item))
+
+        # Instance ID -> instance component, and where the instance lives
+        self.instances = inventoryData["itemComponents"]["instances"]["data"]
+        self.locations = {}
+        for bucketHash, itemInstanceId in self.equipped.items():
+            self.locations[itemInstanceId] = bucketHash
+        for bucketHash, keys in self.carried.items():
+            for key in keys:
+                if isinstance(key, str):
+                    self.locations[key] = bucketHash
+
+    def isEquipped(self, itemInstanceId):
+        bucketHash = self.locations.get(itemInstanceId, None)
+        return self.equipped.get(bucketHash, None) == itemInstanceId
+
+    def diff(self, previous):
+        # Without anything to compare against, everything has changed
+        if previous is None:
+            changes = [
+                Change("equipped", bucketHash, itemInstanceId)
+                for bucketHash, itemInstanceId in self.equipped.items()
+            ]
+            changes += [
+                Change("carried", bucketHash, None)
+                for bucketHash in self.carried
+            ]
+            return changes
+
+        changes = []
+
+        # Compare what's equipped bucket by bucket
+        for bucketHash in self.equipped.keys() | previous.equipped.keys():
+            itemInstanceId = self.equipped.get(bucketHash, None)
+            if itemInstanceId != previous.equipped.get(bucketHash, None):
+                changes.append(Change("equipped", bucketHash, itemInstanceId))
+
+        # Same for what's carried
+        for bucketHash in self.carried.keys() | previous.carried.keys():
+            if self.carried.get(bucketHash) != previous.carried.get(
+                bucketHash
+            ):
+                changes.append(Change("carried", bucketHash, None))
+
+        # And finally the state of every instance still around
+        for itemInstanceId, instance in self.instances.items():
+            previousInstance = previous.instances.get(itemInstanceId, None)
+            if previousInstance is not None and previousInstance != instance:
+                changes.append(
+                    Change(
+                        "instance",
+                        self.locations.get(itemInstanceId, None),
+                        itemInstanceId,
+                    )
+                )
+
+        return changes
+
+
+def splitProfileInventories(profileData):
+    # Break a profile response down into one inventory per character, in the
+    # same shape the per-character endpoint returns
+    instances = profileData["itemComponents"]["instances"]["data"]
+    equipment = profileData["characterEquipment"]["data"]
+    inventories = profileData["characterInventories"]["data"]
+
+    results = {}
+    for characterId in equipment.keys() | inventories.keys():
+        equipped = equipment.get(characterId, {}).get("items", [])
+        carried = inventories.get(characterId, {}).get("items", [])
+
+        # Only the instances this character holds, so changes to items
+        # elsewhere on the profile don't show up in its diffs
+        characterInstances = {}
+        for item in equipped + carried:
+            itemInstanceId = item.get("itemInstanceId", None)
+            if itemInstanceId in instances:
+                characterInstances[itemInstanceId] = instances[itemInstanceId]
+
+        results[characterId] = {
+            "equipment": {"data": {"items": equipped}},
+            "inventory": {"data": {"items": carried}},
+            "itemComponents": {"instances": {"data": characterInstances}},
+        }
+    return results
+
+
+def equipLocally(inventoryData, itemInstanceIds):
+    # What the inventory will look like once the given items are equipped,
+    # without waiting for the API to say so. Each item trades places with
+    # whatever is equipped in its bucket.
+    equipment = list(inventoryData["equipment"]["data"]["items"])
+    inventory = list(inventoryData["inventory"]["data"]["items"])
+
+    for itemInstanceId in itemInstanceIds:
+        index = next(
+            (
+                i
+                for i, item in enumerate(inventory)
+                if item.get("itemInstanceId", None) == itemInstanceId
+            ),
+            None,
+        )
+        if index is None:
+            continue
+
+        item = inventory[index]
+        equippedIndex = next(
+            (
+                i
+                for i, equipped in enumerate(equipment)
+                if equipped["bucketHash"] == item["bucketHash"]
+            ),
+            None,
+        )
+        if equippedIndex is None:
+            equipment.append(item)
+            del inventory[index]
+        else:
+            equipment[equippedIndex], inventory[index] = (
+                item,
+                equipment[equippedIndex],
+            )
+
+    mutated = dict(inventoryData)
+    mutated["equipment"] = {"data": {"items": equipment}}
+    mutated["inventory"] = {"data": {"items": inventory}}
+    return mutated
@@ -2,7 +2,7 @@ from guardiandeck.deck import GuardianDeck
 
 
 def main():
-    GuardianDeck()
+    GuardianDeck().run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,454 @@
+# stdlib imports
+import collections
+import contextlib
+import json
+import os
+import sqlite3
+import struct
+import threading
+import zipfile
+import zlib
+
+# local imports
+import guardiandeck.trace as trace
+
+# SQLite refuses statements with more bound variables than this
+maxVariables = 900
+
+# The handful of item fields the deck actually renders
+ItemProjection = collections.namedtuple(
+    "ItemProjection",
+    ["hash", "name", "icon", "ammoType", "damageType", "bucketHash"],
+)
+
+# Tables whose display name and icon are projected for quick lookup
+displayTables = ["DestinyRaceDefinition", "DestinyClassDefinition"]
+
+
+def hashToId(hash):
+    # The content database stores definition hashes as signed 32-bit ints
+    id = int(hash)
+    if (id & (1 << (32 - 1))) != 0:
+        id = id - (1 << 32)
+    return id
+
+
+def idToHash(id):
+    return id & 0xFFFFFFFF
+
+
+class ContentStream:
+    # Zip local file header, skipping the fields that aren't needed
+    localHeader = struct.Struct("<I2xHH4xI4xIHH")
+    localHeaderSignature = 0x04034B50
+    descriptorSignature = struct.pack("<I", 0x08074B50)
+
+    def __init__(self, destDir):
+        self.destDir = destDir
+
+        # Bytes that arrived before the local header could be parsed, and
+        # after the compressed data ended (the optional data descriptor)
+        self.buffer = b""
+        self.trailer = b""
+
+        # Parsed header fields
+        self.name = None
+        self.flags = 0
+        self.crc = 0
+        self.size = 0
+
+        # Output state
+        self.file = None
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.outputCrc = 0
+        self.outputSize = 0
+
+    def feed(self, chunk):
+        # Wait until the whole local file header has arrived
+        if self.name is None:
+            self.buffer += chunk
+            if not self.parseHeader():
+                return
+            chunk, self.buffer = self.buffer, b""
+
+        # Anything past the end of the compressed data is trailer
+        if self.decompressor.eof:
+            self.trailer += chunk
+            return
+
+        data = self.decompressor.decompress(chunk)
+        self.file.write(data)
+        self.outputCrc = zlib.crc32(data, self.outputCrc)
+        self.outputSize += len(data)
+
+        if self.decompressor.eof:
+            self.trailer += self.decompressor.unused_data
+
+    def parseHeader(self):
+        headerSize = self.localHeader.size
+        if len(self.buffer) < headerSize:
+            return False
+
+        fields = self.localHeader.unpack_from(self.buffer)
+        signature, flags, method, crc, size, nameSize, extraSize = fields
+        if signature != self.localHeaderSignature:
+            raise RuntimeError("Manifest archive is not a zip file")
+        if method != zipfile.ZIP_DEFLATED:
+            raise RuntimeError(f"Unsupported manifest compression ({method})")
+
+        dataStart = headerSize + nameSize + extraSize
+        if len(self.buffer) < dataStart:
+            return False
+
+        # Decompressed output goes to a partial file next to the final one
+        self.name = self.buffer[headerSize : headerSize + nameSize].decode()
+        self.flags, self.crc, self.size = flags, crc, size
+        self.file = (self.destDir / (self.name + ".part")).open("wb")
+        self.buffer = self.buffer[dataStart:]
+        return True
+
+    def finish(self):
+        if self.name is None or not self.decompressor.eof:
+            raise RuntimeError("Manifest archive ended early")
+
+        # When bit 3 is set, the checksum and sizes follow the data instead
+        # of living in the header
+        crc, size = self.crc, self.size
+        if self.flags & 0x08:
+            trailer = self.trailer
+            if trailer.startswith(self.descriptorSignature):
+                trailer = trailer[4:]
+            crc, _, size = struct.unpack_from("<III", trailer)
+
+        self.file.close()
+        partPath = self.destDir / (self.name + ".part")
+        if crc != self.outputCrc or size != (self.outputSize & 0xFFFFFFFF):
+            partPath.unlink()
+            raise RuntimeError("Manifest content failed its integrity check")
+
+        # Swap the finished file into place in one step
+        os.replace(partPath, self.destDir / self.name)
+        return self.name
+
+    def abort(self):
+        if self.file:
+            self.file.close()
+            try:
+                (self.destDir / (self.name + ".part")).unlink()
+            except FileNotFoundError:
+                pass
+
+
+def downloadContent(request, url, destDir, attempts=5, chunkSize=1 << 16):
+    # The archive is decompressed as it streams in, so no zip ever touches
+    # the disk. If the connection drops, the download picks up from the
+    # last received byte while the decompressor keeps its state.
+    import requests
+
+    stream = ContentStream(destDir)
+    received = 0
+    etag = None
+
+    try:
+        for attempt in range(attempts):
+            headers = {}
+            if received:
+                headers["Range"] = f"bytes={received}-"
+                if etag:
+                    headers["If-Range"] = etag
+
+            try:
+                with request(
+                    "get", url, headers=headers, stream=True
+                ) as response:
+                    response.raise_for_status()
+
+                    # A full response to a ranged request means the server
+                    # can't resume, so start over from the beginning
+                    if received and response.status_code != 206:
+                        stream.abort()
+                        stream = ContentStream(destDir)
+                        received = 0
+                    etag = response.headers.get("ETag", etag)
+
+                    for chunk in response.iter_content(chunkSize):
+                        stream.feed(chunk)
+                        received += len(chunk)
+
+                return stream.finish()
+
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as err:
+                print(f"Manifest download interrupted ({err}), resuming...")
+
+        raise RuntimeError("Manifest download failed")
+
+    except Exception:
+        stream.abort()
+        raise
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+
+        # SQLite connections aren't safe to share between threads, so every
+        # thread that queries the manifest lazily opens its own read-only
+        # connections. All of them are tracked so close() can reach them.
+        self._local = threading.local()
+        self._connections = []
+
+        # Guards the memos and connection list, and tracks running queries
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._active = 0
+        self._closed = False
+
+        # Decoded definitions, memoized per table and keyed by unsigned hash
+        self._memo = {}
+
+        # Derived lookup tables, see loadIndexes
+        self.indexes = {}
+
+        # Slim projected store, see loadProjection
+        self.projectionPath = None
+        self._items = {}
+
+    def connect(self, path):
+        connection = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self.connect(self.path)
+        return connection
+
+    @property
+    def projection(self):
+        connection = getattr(self._local, "projection", None)
+        if connection is None:
+            connection = self.connect(self.projectionPath)
+            self._local.projection = connection
+        return connection
+
+    @contextlib.contextmanager
+    def querying(self):
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Manifest has been closed")
+            self._active += 1
+        try:
+            with trace.span("manifest.query"):
+                yield
+        finally:
+            with self._idle:
+                self._active -= 1
+                self._idle.notify_all()
+
+    def close(self):
+        # Let queries already running on other threads finish first
+        with self._idle:
+            self._closed = True
+            self._idle.wait_for(lambda: self._active == 0)
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+    def get(self, table, hash):
+        return self.getMany(table, [hash])[hash]
+
+    def getMany(self, table, hashes):
+        # Only query for definitions that haven't been decoded before
+        with self._lock:
+            memo = self._memo.setdefault(table, {})
+            missing = {idToHash(hashToId(hash)) for hash in hashes}
+            missing = [hashToId(hash) for hash in missing if hash not in memo]
+
+        decoded = {}
+        with self.querying():
+            for i in range(0, len(missing), maxVariables):
+                chunk = missing[i : i + maxVariables]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = self.connection.execute(
+                    f"SELECT id, json FROM {table} WHERE id IN ({placeholders})",
+                    chunk,
+                )
+                for id, found in cursor:
+                    decoded[idToHash(id)] = json.loads(found)
+
+        # Map the results back onto the hashes exactly as they were given
+        results = {}
+        with self._lock:
+            memo.update(decoded)
+            for hash in hashes:
+                definition = memo.get(idToHash(hashToId(hash)), None)
+                if definition is not None:
+                    results[hash] = definition
+        return results
+
+    def getAll(self, table):
+        # Only used while building derived data, before the manifest is
+        # handed out to other threads
+        for row in self.connection.execute(f"SELECT json FROM {table}"):
+            yield json.loads(row[0])
+
+    def buildIndexes(self):
+        # Bucket index -> bucket hash
+        bucketHashes = {}
+        for bucket in self.getAll("DestinyInventoryBucketDefinition"):
+            index = bucket.get("index", None)
+            if index is not None:
+                bucketHashes[str(index)] = bucket["hash"]
+
+        return {"bucketHashes": bucketHashes}
+
+    def loadIndexes(self, indexPath):
+        # Indexes only depend on the manifest content, so they are built
+        # once per version and then read back on every later start
+        if indexPath.exists():
+            with indexPath.open("r") as indexFile:
+                self.indexes = json.load(indexFile)
+            return
+
+        self.indexes = self.buildIndexes()
+
+        # Write to a temporary file first so a crash never leaves a
+        # truncated index behind
+        tempPath = indexPath.with_name(indexPath.name + ".tmp")
+        with tempPath.open("w") as indexFile:
+            json.dump(self.indexes, indexFile)
+        os.replace(tempPath, indexPath)
+
+    def bucketHash(self, index):
+        return self.indexes["bucketHashes"].get(str(index), None)
+
+    def buildProjection(self, projectionPath):
+        connection = sqlite3.connect(projectionPath)
+        with connection:
+            connection.execute(
+                "CREATE TABLE Item (id INTEGER PRIMARY KEY, name TEXT, "
+                "icon TEXT, ammoType INTEGER, damageType INTEGER, "
+                "bucketHash INTEGER)"
+            )
+            connection.execute(
+                "CREATE TABLE Display (tableName TEXT, id INTEGER, name TEXT, "
+                "icon TEXT, PRIMARY KEY (tableName, id))"
+            )
+
+            # Flatten the item definitions down to typed columns
+            connection.executemany(
+                "INSERT INTO Item VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        hashToId(item["hash"]),
+                        item["displayProperties"].get("name", ""),
+                        item["displayProperties"].get("icon", None),
+                        item.get("equippingBlock", {}).get("ammoType", 0),
+                        item.get("defaultDamageType", 0),
+                        item.get("inventory", {}).get("bucketTypeHash", 0),
+                    )
+                    for item in self.getAll("DestinyInventoryItemDefinition")
+                ),
+            )
+
+            # And the few other tables only ever used for their names
+            for table in displayTables:
+                connection.executemany(
+                    "INSERT INTO Display VALUES (?, ?, ?, ?)",
+                    (
+                        (
+                            table,
+                            hashToId(definition["hash"]),
+                            definition["displayProperties"].get("name", ""),
+                            definition["displayProperties"].get("icon", None),
+                        )
+                        for definition in self.getAll(table)
+                    ),
+                )
+        connection.close()
+
+    def loadProjection(self, projectionPath):
+        # Like the indexes, the projection is built once per version. It is
+        # written under a temporary name and moved into place when complete.
+        if not projectionPath.exists():
+            tempPath = projectionPath.with_name(projectionPath.name + ".tmp")
+            if tempPath.exists():
+                tempPath.unlink()
+            self.buildProjection(tempPath)
+            os.replace(tempPath, projectionPath)
+
+        self.projectionPath = projectionPath
+
+    def getItems(self, hashes):
+        with self._lock:
+            missing = {idToHash(hashToId(hash)) for hash in hashes}
+            missing = [hash for hash in missing if hash not in self._items]
+
+        # Without a projection, fall back to the full JSON definitions
+        found = {}
+        if missing and self.projectionPath is None:
+            definitions = self.getMany(
+                "DestinyInventoryItemDefinition", missing
+            )
+            for hash, item in definitions.items():
+                found[hash] = ItemProjection(
+                    hash,
+                    item["displayProperties"].get("name", ""),
+                    item["displayProperties"].get("icon", None),
+                    item.get("equippingBlock", {}).get("ammoType", 0),
+                    item.get("defaultDamageType", 0),
+                    item.get("inventory", {}).get("bucketTypeHash", 0),
+                )
+
+        # Else, read just the typed columns
+        elif missing:
+            missing = [hashToId(hash) for hash in missing]
+            with self.querying():
+                for i in range(0, len(missing), maxVariables):
+                    chunk = missing[i : i + maxVariables]
+                    placeholders = ",".join("?" * len(chunk))
+                    cursor = self.projection.execute(
+                        "SELECT id, name, icon, ammoType, damageType, "
+                        f"bucketHash FROM Item WHERE id IN ({placeholders})",
+                        chunk,
+                    )
+                    for row in cursor:
+                        found[idToHash(row[0])] = ItemProjection(
+                            idToHash(row[0]), *row[1:]
+                        )
+
+        # Map the results back onto the hashes exactly as they were given
+        results = {}
+        with self._lock:
+            self._items.update(found)
+            for hash in hashes:
+                item = self._items.get(idToHash(hashToId(hash)), None)
+                if item is not None:
+                    results[hash] = item
+        return results
+
+    def getItem(self, hash):
+        return self.getItems([hash])[hash]
+
+    def getName(self, table, hash):
+        # Tables outside the projection still go through the JSON path
+        if self.projectionPath is None or table not in displayTables:
+            return self.get(table, hash)["displayProperties"]["name"]
+
+        with self.querying():
+            found = self.projection.execute(
+                "SELECT name FROM Display WHERE tableName=? AND id=?",
+                (table, hashToId(hash)),
+            ).fetchone()
+        if found is None:
+            raise KeyError(hash)
+        return found[0]
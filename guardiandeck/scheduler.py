@@ -0,0 +1,84 @@
+# stdlib imports
+import asyncio
+import random
+import time
+
+
+class PollScheduler:
+    def __init__(
+        self,
+        activeDelay=1.5,
+        idleDelay=5,
+        maxDelay=120,
+        backoff=1.5,
+        activeWindow=30,
+        jitter=0.1,
+    ):
+        self.activeDelay = activeDelay
+        self.idleDelay = idleDelay
+        self.maxDelay = maxDelay
+        self.backoff = backoff
+        self.activeWindow = activeWindow
+        self.jitter = jitter
+
+        # Current idle delay, grown while nothing changes
+        self.delay = idleDelay
+
+        # Monotonic timestamps of the last user action, and of when the
+        # server said it would accept requests again
+        self.lastActivity = None
+        self.throttledUntil = 0
+
+        # Set to cut a pending wait short
+        self._wake = asyncio.Event()
+
+    def isActive(self):
+        return (
+            self.lastActivity is not None
+            and time.monotonic() - self.lastActivity < self.activeWindow
+        )
+
+    def activity(self):
+        # A user action means changes are likely, so poll again soon
+        self.lastActivity = time.monotonic()
+        self.delay = self.idleDelay
+        self._wake.set()
+
+    def throttle(self, seconds):
+        if seconds > 0:
+            self.throttledUntil = max(
+                self.throttledUntil, time.monotonic() + seconds
+            )
+
+    def record(self, changed):
+        # Back off exponentially while polls keep coming back unchanged
+        if changed:
+            self.delay = self.idleDelay
+        else:
+            self.delay = min(self.delay * self.backoff, self.maxDelay)
+
+    def nextDelay(self):
+        delay = self.activeDelay if self.isActive() else self.delay
+
+        # Jitter keeps polls from settling into lockstep with anything else
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+
+        # Never poll before the server is ready for it
+        return max(delay, self.throttledUntil - time.monotonic())
+
+    async def wait(self):
+        deadline = time.monotonic() + self.nextDelay()
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+            # Woken by user activity, so the poll can probably come sooner
+            deadline = min(deadline, time.monotonic() + self.nextDelay())
@@ -1,74 +1,181 @@
 # stdlib imports
+import json
 import pprint
+import sys
+import traceback
 
 # vendor imports
 from PIL import Image, ImageDraw
 from StreamDeck.ImageHelpers import PILHelper
 
 # local imports
+from guardiandeck.api import APIError, SingleFlight
 from guardiandeck.config import chassis, font12
 from guardiandeck.frame import InteractionFrame
 import guardiandeck.helpers as helpers
 
+# Items shown at once, on the 3x3 grid between the page keys and the bucket
+pageSize = 9
+
 
 class BucketMenuStage(InteractionFrame):
-    def setup(self):
+    @classmethod
+    def cacheKey(cls, deck, options):
+        # The menu only shows what's equipped in and carried in its bucket
+        snapshot = deck.inventorySnapshot
+        if snapshot is None:
+            return None
+
+        bucketHash = options["bucketHash"]
+        items = [snapshot.equipped.get(bucketHash, None)]
+        items += snapshot.carried.get(bucketHash, [])
+        return tuple(
+            (
+                (key, json.dumps(snapshot.instances.get(key), sort_keys=True))
+                if isinstance(key, str)
+                else key
+            )
+            for key in items
+        )
+
+    async def setup(self):
+        # Everything is drawn from the inventory as it is now, even if a
+        # poll replaces it while the tiles are drawn
+        self.inventoryData = self.deck.inventoryData
         self.bucketIndex = self.options["bucketIndex"]
         self.bucketHash = self.options["bucketHash"]
 
-        # Copy icon from the previous bucket
-        self.keys[4][0] = self.deck._stack[1].keys[4][self.bucketIndex]
-
-        # Figure out every item in this bucket
-        bucketItems = []
-        for item in self.deck.inventoryData["inventory"]["data"]["items"]:
+        # Show the equipped item in the corner. It's the same tile the
+        # splash shows, so it comes straight from the cache.
+        for item in self.inventoryData["equipment"]["data"]["items"]:
+            if item["bucketHash"] == self.bucketHash:
+                self.keys[4][0] = await helpers.generateItemIcon(
+                    self.deck, self.inventoryData, item
+                )
+
+        # Figure out every item in this bucket. Tiles are only drawn for
+        # the page that's showing, and the pages next to it.
+        self.bucketItems = []
+        for item in self.inventoryData["inventory"]["data"]["items"]:
             if item["bucketHash"] == self.bucketHash:
-                bucketItems.append(item)
+                self.bucketItems.append(item)
+        self.pageCount = max(1, -(-len(self.bucketItems) // pageSize))
 
-        print("BUCKET ITEMS")
+        print(f"BUCKET ITEMS ({len(self.bucketItems)})")
 
+        self.pageTiles = {}
+        self.pageFlights = SingleFlight()
+        self.page = 0
         self.selections = {}
+        await self.showPage(0)
 
-        # Insert icons
-        for i, item in enumerate(bucketItems):
-            # Convert index to local 3x3 grid (in reverse x-order)
-            localX = i % 3
-            localY = (i - localX) // 3
-            localX = 3 - localX
-
-            itemInstanceInfo = self.deck.inventoryData["itemComponents"][
-                "instances"
-            ]["data"][item["itemInstanceId"]]
-            itemInfo = self.deck.manifestGet(
-                "DestinyInventoryItemDefinition", item["itemHash"]
-            )
+    def pageItems(self, page):
+        return self.bucketItems[page * pageSize : (page + 1) * pageSize]
 
-            print(f'{i}: {itemInfo["displayProperties"]["name"]}')
-            print(item)
+    async def drawPage(self, page):
+        items = self.pageItems(page)
 
-            self.selections[(localX, localY)] = item["itemInstanceId"]
+        # Look up the definitions of just this page in one query
+        await self.deck.queryItems([item["itemHash"] for item in items])
 
-            self.keys[localX][localY] = helpers.generateItemIcon(
-                self.deck, self.deck.inventoryData, item
+        tiles = []
+        for item in items:
+            tiles.append(
+                await helpers.generateItemIcon(
+                    self.deck, self.inventoryData, item
+                )
             )
+        self.pageTiles[page] = tiles
+        return tiles
+
+    async def renderPage(self, page):
+        tiles = self.pageTiles.get(page, None)
+        if tiles is not None:
+            return tiles
+        return await self.pageFlights.run(page, lambda: self.drawPage(page))
+
+    async def prerenderPage(self, page):
+        # Draw a page ahead of time, so flipping to it is instant
+        try:
+            await self.renderPage(page)
+        except Exception:
+            print(
+                "Prerendering failed:\n",
+                "".join(traceback.format_exception(*sys.exc_info())),
+            )
+
+    async def showPage(self, page):
+        tiles = await self.renderPage(page)
+        self.page = page
 
-        print()
+        # Only the page showing and its neighbours keep their tiles
+        for other in list(self.pageTiles):
+            if abs(other - page) > 1:
+                del self.pageTiles[other]
+
+        # Lay the page out on the 3x3 grid (in reverse x-order)
+        self.selections = {}
+        for i in range(pageSize):
+            localX = 3 - (i % 3)
+            localY = i // 3
+            if i < len(tiles):
+                item = self.pageItems(page)[i]
+                self.selections[(localX, localY)] = item["itemInstanceId"]
+                self.keys[localX][localY] = tiles[i]
+            else:
+                self.keys[localX][localY] = None
+
+        # Page controls, only when there is somewhere to go
+        self.keys[0][0] = await self.pageKey("Previous", page > 0)
+        self.keys[0][1] = await self.pageKey("Next", page < self.pageCount - 1)
+
+        if self.active:
+            await self.deck.renderStack()
+
+        for neighbour in (page + 1, page - 1):
+            if 0 <= neighbour < self.pageCount:
+                self.deck.loop.create_task(self.prerenderPage(neighbour))
+
+    async def pageKey(self, label, enabled):
+        if not enabled:
+            return None
+        return await self.deck.fetchTile(
+            ("label", label),
+            lambda: self.deck.offload(
+                helpers.composeLabelTile, self.deck, label
+            ),
+        )
 
     async def press(self, x, y):
         if x == 4:
-            self.deck.popFrame()
+            await self.deck.popFrame()
+        elif x == 0 and y == 0:
+            if self.page > 0:
+                await self.showPage(self.page - 1)
+        elif x == 0 and y == 1:
+            if self.page < self.pageCount - 1:
+                await self.showPage(self.page + 1)
         elif x > 0 and x < 4:
-            itemInstanceId = self.selections[(x, y)]
-
-            response = self.deck.apiCall(
-                "/Platform/Destiny2/Actions/Items/EquipItem/",
-                method="post",
-                data={
-                    "itemId": itemInstanceId,
-                    "characterId": self.deck.characterId,
-                    "membershipType": self.deck.membershipType,
-                },
-            )
+            itemInstanceId = self.selections.get((x, y), None)
+            if itemInstanceId is None:
+                return
+
+            try:
+                response = await self.deck.apiCall(
+                    "/Platform/Destiny2/Actions/Items/EquipItem/",
+                    method="post",
+                    strict=True,
+                    data={
+                        "itemId": itemInstanceId,
+                        "characterId": self.deck.characterId,
+                        "membershipType": self.deck.membershipType,
+                    },
+                )
+            except APIError as err:
+                print(f"Could not equip {itemInstanceId} ({err})")
+                return
 
             print("equip response", response)
 
+            # Show it as equipped now; the next poll will confirm it
+            await self.deck.equipLocally([itemInstanceId])
@@ -6,20 +6,30 @@ from PIL import Image, ImageDraw
 from StreamDeck.ImageHelpers import PILHelper
 
 # local imports
-from guardiandeck.config import chassis, font12
+from guardiandeck.config import chassis, font12, fontLock
 from guardiandeck.frame import InteractionFrame
+import guardiandeck.trace as trace
 from guardiandeck.stages.CharacterSplash import CharacterSplashStage
 
 
 class CharacterSelectionStage(InteractionFrame):
-    def setup(self):
+    async def setup(self):
         # Place choose graphic
-        self.keys[2][0] = self.deck.prepareImage(
-            Image.open(chassis.store.root / "assets" / "choose.png")
+        self.keys[2][0] = await self.deck.offload(
+            lambda: self.deck.prepareImage(
+                Image.open(chassis.store.root / "assets" / "choose.png")
+            )
         )
 
+        self.blank = await self.deck.offload(
+            self.deck.prepareImage, Image.new("RGB", (72, 72), (50, 50, 50))
+        )
+
+        await self.layout(self.options["characters"])
+
+    async def layout(self, characters):
         # Parse the characters
-        self.characters = self.options["characters"]
+        self.characters = characters
         self.selections = []
         for i, characterId in enumerate(self.characters):
             character = self.characters[characterId]
@@ -29,36 +39,63 @@ class CharacterSelectionStage(InteractionFrame):
             self.keys[i + 1][1] = character["emblemPath"]
 
             # Insert information tile below
-            self.keys[i + 1][2] = self.infoTile(character)
-
-        blank = self.deck.prepareImage(
-            Image.new("RGB", (72, 72), (50, 50, 50))
-        )
+            self.keys[i + 1][2] = await self.infoTile(character)
 
         # Add empty selections
         for i in range(3 - len(self.characters)):
-            self.keys[3 - i][1] = blank
-
-    def infoTile(self, character):
-        # Create blank canvas
-        canvas = Image.new("RGB", (72, 72))
-        brush = ImageDraw.Draw(canvas)
-
-        # Get the character details
-        charRace = self.deck.manifestGet(
-            "DestinyRaceDefinition", character["raceHash"]
-        )["displayProperties"]["name"]
-        charClass = self.deck.manifestGet(
-            "DestinyClassDefinition", character["classHash"]
-        )["displayProperties"]["name"]
-
-        # Write light level
-        brush.multiline_text(
-            (8, 8),
-            f'lvl {character["light"]}\n{charRace}\n{charClass}',
-            fill=(255, 255, 255),
-            font=font12,
+            self.keys[3 - i][1] = self.blank
+            self.keys[3 - i][2] = None
+
+    async def updateCharacters(self, characters):
+        # Keys that come out the same are skipped when rendering, so only
+        # the tiles that actually changed get written
+        await self.layout(characters)
+        if self.active:
+            await self.deck.renderStack()
+
+    async def infoTile(self, character):
+        async def render():
+            # Get the character details
+            charRace = await self.deck.queryName(
+                "DestinyRaceDefinition", character["raceHash"]
+            )
+            charClass = await self.deck.queryName(
+                "DestinyClassDefinition", character["classHash"]
+            )
+
+            return await self.deck.offload(
+                self.renderInfoTile, character["light"], charRace, charClass
+            )
+
+        # Cached by what goes into it, so a saved tile can be shown before
+        # the manifest is even open. Without one, a blank holds its place
+        # until updateCharacters runs once the manifest is ready.
+        key = (
+            "info",
+            character["light"],
+            character["raceHash"],
+            character["classHash"],
         )
+        if not self.deck.manifestReady.is_set():
+            tile = await self.deck.peekTile(key)
+            return self.blank if tile is None else tile
+
+        return await self.deck.fetchTile(key, render)
+
+    def renderInfoTile(self, light, charRace, charClass):
+        with trace.span("render.infoTile"):
+            # Create blank canvas
+            canvas = Image.new("RGB", (72, 72))
+            brush = ImageDraw.Draw(canvas)
+
+            # Write light level
+            with fontLock:
+                brush.multiline_text(
+                    (8, 8),
+                    f"lvl {light}\n{charRace}\n{charClass}",
+                    fill=(255, 255, 255),
+                    font=font12,
+                )
 
         return self.deck.prepareImage(canvas)
 
@@ -67,8 +104,9 @@ class CharacterSelectionStage(InteractionFrame):
         if x >= 1 and x <= 3 and y == 1:
             index = x - 1
             if index < len(self.selections):
-                self.deck.characterId = self.selections[index]
-                self.deck.character = self.characters[self.deck.characterId]
-                self.deck.startInventoryPoll()
+                characterId = self.selections[index]
+                self.deck.selectCharacter(
+                    characterId, self.characters[characterId]
+                )
 
-                self.deck.pushFrame(CharacterSplashStage)
+                await self.deck.pushFrame(CharacterSplashStage)
@@ -1,5 +1,4 @@
 # stdlib imports
-import asyncio
 import hashlib
 import json
 import marshal
@@ -9,67 +8,218 @@ import time
 # vendor imports
 
 # local imports
+from guardiandeck.api import APIError
 from guardiandeck.config import chassis
 import guardiandeck.helpers as helpers
 from guardiandeck.frame import InteractionFrame
 from guardiandeck.stages.BucketMenu import BucketMenuStage
 
+# Loadouts are bound to the keys at x = 1..3 on the bottom row
+loadoutKeys = 3
+
 
 class CharacterSplashStage(InteractionFrame):
-    def setup(self):
+    async def setup(self):
         # Variables
         self.killFlag = False
         self.inventoryHash = ""
 
+        # Characters can be chosen from the saved profile before the
+        # manifest is open, and everything from here on needs it
+        await self.deck.manifestReady.wait()
+
         # Determine which buckets we need to track
-        self.buckets = [None for i in range(3)]
-        for bucket in self.deck.manifestGetAll(
-            "DestinyInventoryBucketDefinition"
-        ):
-            index = bucket.get("index", None)
-            if index >= 0 and index <= 2:
-                self.buckets[index] = bucket["hash"]
+        self.buckets = [self.deck.manifest.bucketHash(i) for i in range(3)]
 
         # Subscribe to inventory changes
         self.deck.subscribeInventory(self.updateInventory)
 
-        # If inventory data already exists, call an immediate update
-        if self.deck.inventoryData:
-            print("Calling first update")
-            asyncio.run(self.updateInventory())
+        # Draw the loadout keys, and the weapons if inventory data already
+        # exists
+        await self.updateInventory()
 
-    # def destroy(self):
-    #     if self.pollingThread.is_alive():
-    #         self.killFlag = True
-    #         self.pollingThread.join()
+    def destroy(self):
+        # Stop listening, or the deck would keep this frame (and every tile
+        # it holds) alive for as long as it polls
+        self.deck.subscribeInventory(self.updateInventory, False)
 
-    async def updateInventory(self):
+    async def updateInventory(self, changes=None):
         # Get character data
         # character = self.options["character"]
         # characterId = character["characterId"]
 
         print("Update!")
 
-        # Insert icons for the three equipped weapons
-        for item in self.deck.inventoryData["equipment"]["data"]["items"]:
+        # Without a change set everything is drawn again, since it may even
+        # be a different character now
+        if changes is None:
+            await self.updateLoadouts()
+            if not self.deck.inventoryData:
+                for bucketIndex in range(len(self.buckets)):
+                    self.keys[4][bucketIndex] = None
+                if self.active:
+                    await self.deck.renderStack()
+                return
+
+        # Every bucket menu whose contents changed in any way is built again
+        # once the tiles here are drawn, so opening one is instant
+        if changes is None:
+            stale = set(self.buckets)
+        else:
+            stale = {change.bucketHash for change in changes}
+
+        # Work out which tracked buckets need a new tile. Without a change
+        # set, that's all of them.
+        if changes is None:
+            affected = set(self.buckets)
+        else:
+            snapshot = self.deck.inventorySnapshot
+            affected = {
+                change.bucketHash
+                for change in changes
+                if change.bucketHash in self.buckets
+                and (
+                    change.kind == "equipped"
+                    or (
+                        change.kind == "instance"
+                        and snapshot.isEquipped(change.itemInstanceId)
+                    )
+                )
+            }
+        if not affected:
+            self.prewarmMenus(stale)
+            return
+
+        # Warm the definition cache for the affected items in one query
+        equipment = [
+            item
+            for item in self.deck.inventoryData["equipment"]["data"]["items"]
+            if item["bucketHash"] in affected
+        ]
+        await self.deck.queryItems([item["itemHash"] for item in equipment])
+
+        # Insert icons for the affected equipped weapons
+        for item in equipment:
             bucketHash = item["bucketHash"]
             if bucketHash in self.buckets:
                 bucketIndex = self.buckets.index(bucketHash)
 
-                self.keys[4][bucketIndex] = helpers.generateItemIcon(
+                self.keys[4][bucketIndex] = await helpers.generateItemIcon(
                     self.deck, self.deck.inventoryData, item
                 )
 
         # Trigger a re-render
         if self.active:
-            self.deck.renderStack()
+            await self.deck.renderStack()
+
+        self.prewarmMenus(stale)
+
+    def prewarmMenus(self, bucketHashes):
+        # Build the menus of these buckets in the background
+        for bucketIndex, bucketHash in enumerate(self.buckets):
+            if bucketHash in bucketHashes:
+                self.deck.loop.create_task(
+                    self.deck.prewarmFrame(
+                        BucketMenuStage,
+                        {"bucketHash": bucketHash, "bucketIndex": bucketIndex},
+                    )
+                )
+
+    def loadouts(self):
+        # Saved loadouts of this character, one list of item instance IDs
+        # (or None) per loadout key
+        saved = chassis.props.loadouts.get() or {}
+        loadouts = list(saved.get(self.deck.characterId, []))
+        return loadouts + [None] * (loadoutKeys - len(loadouts))
+
+    async def updateLoadouts(self):
+        for i, loadout in enumerate(self.loadouts()):
+            label = f"Loadout {i + 1}" if loadout else "Empty"
+            self.keys[i + 1][2] = await self.deck.fetchTile(
+                ("label", label),
+                lambda: self.deck.offload(
+                    helpers.composeLabelTile, self.deck, label
+                ),
+            )
+
+    async def saveLoadout(self, index):
+        if not self.deck.inventoryData:
+            return
+
+        # Everything equipped in the tracked buckets
+        itemIds = [
+            item["itemInstanceId"]
+            for item in self.deck.inventoryData["equipment"]["data"]["items"]
+            if item["bucketHash"] in self.buckets
+        ]
+
+        saved = dict(chassis.props.loadouts.get() or {})
+        loadouts = self.loadouts()
+        loadouts[index] = itemIds
+        saved[self.deck.characterId] = loadouts
+        chassis.props.loadouts.set(saved)
+        chassis.props.sync()
+
+        await self.updateLoadouts()
+        if self.active:
+            await self.deck.renderStack()
+
+    async def applyLoadout(self, index):
+        loadout = self.loadouts()[index]
+        if not loadout or self.deck.inventorySnapshot is None:
+            return
+
+        # Skip whatever is already equipped
+        snapshot = self.deck.inventorySnapshot
+        itemIds = [
+            itemId for itemId in loadout if not snapshot.isEquipped(itemId)
+        ]
+        if not itemIds:
+            return
+
+        # Every slot in one request
+        try:
+            response = await self.deck.apiCall(
+                "/Platform/Destiny2/Actions/Items/EquipItems/",
+                method="post",
+                strict=True,
+                data={
+                    "itemIds": itemIds,
+                    "characterId": self.deck.characterId,
+                    "membershipType": self.deck.membershipType,
+                },
+            )
+        except APIError as err:
+            print(f"Could not apply loadout {index + 1} ({err})")
+            return
+
+        # Show whatever went through at once, then refresh once to confirm
+        equipped = []
+        for result in response.get("equipResults", []):
+            if result.get("equipStatus", 1) == 1:
+                equipped.append(result["itemInstanceId"])
+            else:
+                print(
+                    f"Could not equip {result['itemInstanceId']}"
+                    f" ({result['equipStatus']})"
+                )
+        await self.deck.equipLocally(equipped)
+
+        await self.deck.refreshInventory()
 
     async def press(self, x, y):
-        if x == 4:
+        if y == 2 and 1 <= x <= loadoutKeys:
+            # Holding the bottom left key saves, otherwise it's applied
+            if self.deck.hold1:
+                await self.saveLoadout(x - 1)
+            else:
+                await self.applyLoadout(x - 1)
+
+        elif x == 4:
             bucketIndex = y
 
             # Create a new frame for the chosen bucket
-            self.deck.pushFrame(
+            await self.deck.pushFrame(
                 BucketMenuStage,
                 {
                     "bucketHash": self.buckets[bucketIndex],
@@ -0,0 +1,307 @@
+# stdlib imports
+import asyncio
+import collections
+import hashlib
+import sys
+import traceback
+
+# vendor imports
+from StreamDeck.ImageHelpers import PILHelper
+
+# local imports
+from guardiandeck.api import SingleFlight
+from guardiandeck.frame import LoadingFrame
+import guardiandeck.trace as trace
+
+# Every frame is laid out on a grid of this many columns and rows
+gridColumns = 5
+gridRows = 3
+
+# Built frames kept for reuse, per surface
+maxCachedFrames = 16
+
+
+class DeckSurface:
+    def __init__(self, app, device):
+        # Everything that isn't specific to this device (API, manifest,
+        # caches, inventory) lives on the app and is shared by every surface
+        self.app = app
+        self.device = device
+        self.hold1 = False
+        self._stack = []
+        self.renderLock = asyncio.Lock()
+
+        # Frames that were set up already. There's one per class and options,
+        # kept along with whatever its content depended on. Building one is
+        # done once and shared.
+        self.frameCache = collections.OrderedDict()
+        self.frameFlights = SingleFlight()
+
+        # Physical key layout, which the frame grid is centered on
+        rows, columns = device.key_layout()
+        if columns < gridColumns or rows < gridRows:
+            raise RuntimeError(
+                f"{device.deck_type()} has too few keys ({columns}x{rows})"
+            )
+        self.columns = columns
+        self.offsetX = (columns - gridColumns) // 2
+        self.offsetY = (rows - gridRows) // 2
+
+        # Native images are only interchangeable between identical formats
+        imageFormat = device.key_image_format()
+        self.imageSize = imageFormat["size"]
+        self.imageFormat = (
+            imageFormat["size"],
+            imageFormat["format"],
+            imageFormat["flip"],
+            imageFormat["rotation"],
+        )
+
+        # Content hash of what each key currently shows. The deck is reset
+        # when opened, so nothing is known to be on it yet.
+        self._keyHashes = [False] * device.key_count()
+
+    def __getattr__(self, name):
+        # Frames and helpers reach the shared app state through their surface
+        return getattr(self.app, name)
+
+    def key(self, x, y):
+        return ((y + self.offsetY) * self.columns) + x + self.offsetX
+
+    def coords(self, n):
+        x = n % self.columns
+        y = (n - x) // self.columns
+        return (x - self.offsetX, y - self.offsetY)
+
+    def prepareImage(self, image):
+        # Tiles are drawn at 72x72, so scale them for larger keys, convert
+        # to RGB, and pass through the helper
+        with trace.span("render.native"):
+            image = image.convert("RGB")
+            if image.size != self.imageSize:
+                image = image.resize(self.imageSize)
+            return PILHelper.to_native_format(self.device, image)
+
+    async def fetchTile(self, key, render):
+        # Finished tiles are looked up by what they were made from plus the
+        # kind of device they were prepared for
+        cacheKey = (key, self.imageFormat)
+        tile = self.imageCache.get(cacheKey)
+        if tile is not None:
+            return tile
+
+        return await self.imageFlights.run(
+            ("tile", cacheKey), lambda: self.loadTile(cacheKey, render)
+        )
+
+    async def peekTile(self, key):
+        # A finished tile, but only if one is cached. Nothing is rendered.
+        cacheKey = (key, self.imageFormat)
+        tile = self.imageCache.get(cacheKey)
+        if tile is None:
+            tile = await self.offload(self.tileCache.get, repr(cacheKey))
+            if tile is not None:
+                self.imageCache.put(cacheKey, tile)
+        return tile
+
+    async def fetchNativeImage(self, route):
+        async def render():
+            image = await self.fetchCachedImage(route)
+            return await self.offload(self.prepareImage, image)
+
+        return await self.fetchTile(("route", route), render)
+
+    def keyHash(self, value):
+        # Blank keys and routes are identified by value, raw images by content
+        if value is None or isinstance(value, str):
+            return value
+        return hashlib.blake2b(value, digest_size=16).digest()
+
+    async def renderStack(self):
+        # One render at a time, so a slow one can't finish after a newer one
+        # and leave a frame that's no longer on top showing
+        async with self.renderLock:
+            with trace.span("render.stack"):
+                await self.renderKeys()
+
+    async def renderKeys(self):
+        # If the stack is empty, zero out all keys to black
+        if len(self._stack) == 0:
+            frame = None
+            keys = [
+                [None for y in range(gridRows)] for x in range(gridColumns)
+            ]
+
+        # Else, render the keys of the top-most frame
+        else:
+            frame = self._stack[0]
+            keys = frame.keys
+
+        # Resolve every image before writing any of them, since fetching one
+        # may have to wait on a download
+        writes = []
+        for x in range(gridColumns):
+            for y in range(gridRows):
+                keyNo = self.key(x, y)
+                value = keys[x][y]
+
+                # Skip any key that already shows this content
+                valueHash = self.keyHash(value)
+                if self._keyHashes[keyNo] == valueHash:
+                    continue
+
+                # If the value is null, black out the key
+                if value is None:
+                    image = self.device.BLANK_KEY_IMAGE
+
+                # If the value is a string, try and download from a url
+                elif isinstance(value, str):
+                    image = await self.fetchNativeImage(value)
+
+                # Else try and directly transfer the value
+                else:
+                    image = value
+
+                writes.append((keyNo, image, valueHash))
+
+        # A frame pushed or popped meanwhile has its own render queued up
+        topFrame = self._stack[0] if len(self._stack) else None
+        if topFrame is not frame:
+            return
+
+        for keyNo, image, valueHash in writes:
+            with trace.span("usb.write"):
+                self.device.set_key_image(keyNo, image)
+            self._keyHashes[keyNo] = valueHash
+
+    async def setupStack(self):
+        self._stack = []
+        await self.pushFrame(LoadingFrame)
+
+    async def pressStack(self, deck, key, state):
+        # Any key press counts as activity, so inventory changes show sooner
+        self.pollScheduler.activity()
+
+        # Check for exit conditions
+        if key == self.key(0, 2):
+            self.hold1 = state
+        elif key == self.key(0, 0) and self.hold1:
+            self.loop.stop()
+
+        # Keys outside of the frame grid don't do anything
+        x, y = self.coords(key)
+        if not (0 <= x < gridColumns and 0 <= y < gridRows):
+            return
+
+        if state is False:
+            if len(self._stack):
+                try:
+                    # Covers everything up to the last key write it causes
+                    with trace.span("press"):
+                        await self._stack[0].press(x, y)
+                except Exception:
+                    print(
+                        "Unexpected error:\n",
+                        "".join(traceback.format_exception(*sys.exc_info())),
+                    )
+
+    def frameSlot(self, frameClass, frameOptions):
+        return (frameClass, tuple(sorted(frameOptions.items())))
+
+    def isCachedFrame(self, frame):
+        return any(frame is cached for _, cached in self.frameCache.values())
+
+    def dropFrame(self, frame):
+        # Frames still on the stack are destroyed once they're popped
+        if frame not in self._stack:
+            frame.destroy()
+
+    async def buildFrame(self, slot, frameClass, frameOptions):
+        # Nothing can change between here and the start of setup, so this
+        # is the content the frame is actually built from
+        contentKey = frameClass.cacheKey(self, frameOptions)
+        instance = frameClass(self, False, frameOptions)
+        with trace.span(f"setup.{frameClass.__name__}"):
+            await instance.setup()
+
+        # Replace the frame built from older content, and let go of the
+        # least recently used ones
+        previous = self.frameCache.pop(slot, None)
+        if previous is not None:
+            self.dropFrame(previous[1])
+        self.frameCache[slot] = (contentKey, instance)
+        while len(self.frameCache) > maxCachedFrames:
+            _, (_, evicted) = self.frameCache.popitem(last=False)
+            self.dropFrame(evicted)
+        return instance
+
+    async def fetchFrame(self, frameClass, frameOptions):
+        # A set up frame for these options and this content, reused if
+        # there's one already
+        slot = self.frameSlot(frameClass, frameOptions)
+        contentKey = frameClass.cacheKey(self, frameOptions)
+        cached = self.frameCache.get(slot, None)
+        if cached is not None and cached[0] == contentKey:
+            self.frameCache.move_to_end(slot)
+            return cached[1]
+
+        return await self.frameFlights.run(
+            (slot, contentKey),
+            lambda: self.buildFrame(slot, frameClass, frameOptions),
+        )
+
+    async def prewarmFrame(self, frameClass, frameOptions):
+        # Build a frame ahead of time, so pushing it later is instant
+        try:
+            if frameClass.cacheKey(self, frameOptions) is not None:
+                await self.fetchFrame(frameClass, frameOptions)
+        except Exception:
+            print(
+                "Prewarming failed:\n",
+                "".join(traceback.format_exception(*sys.exc_info())),
+            )
+
+    async def pushFrame(self, frameClass, frameOptions={}):
+        # Mark the current top frame as inactive
+        if len(self._stack) > 0:
+            self._stack[0].setActive(False)
+
+        # Frames that can be reused come set up from the cache
+        if frameClass.cacheKey(self, frameOptions) is not None:
+            instance = await self.fetchFrame(frameClass, frameOptions)
+            instance.setActive(True)
+            self._stack.insert(0, instance)
+
+        # Create instance of the new frame and push it to the stack
+        else:
+            instance = frameClass(self, True, frameOptions)
+            self._stack.insert(0, instance)
+            with trace.span(f"setup.{frameClass.__name__}"):
+                await instance.setup()
+
+        await self.renderStack()
+
+    async def popFrame(self):
+        if len(self._stack):
+            # Pop out the top frame, deactivate it, and destroy it
+            frame = self._stack.pop(0)
+            frame.setActive(False)
+            if not self.isCachedFrame(frame):
+                frame.destroy()
+            del frame
+
+            # If there's a frame left, set it as active
+            if len(self._stack):
+                self._stack[0].setActive(True)
+
+            await self.renderStack()
+
+    def destroyStack(self):
+        for frame in self._stack:
+            frame.setActive(False)
+            frame.destroy()
+        for _, frame in self.frameCache.values():
+            if frame not in self._stack:
+                frame.destroy()
+        self._stack = []
+        self.frameCache.clear()
@@ -0,0 +1,85 @@
+# stdlib imports
+import collections
+import contextlib
+import json
+import threading
+import time
+
+# Only the most recent samples of each span are kept, which bounds memory
+# while still giving stable percentiles
+maxSamples = 4096
+
+_samples = collections.defaultdict(
+    lambda: collections.deque(maxlen=maxSamples)
+)
+_counts = collections.Counter()
+_lock = threading.Lock()
+
+
+def record(name, seconds):
+    with _lock:
+        _samples[name].append(seconds)
+        _counts[name] += 1
+
+
+@contextlib.contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    index = min(int(fraction * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+def summary():
+    with _lock:
+        samples = {name: sorted(values) for name, values in _samples.items()}
+        counts = dict(_counts)
+
+    # Everything is reported in milliseconds
+    results = {}
+    for name, ordered in sorted(samples.items()):
+        if not ordered:
+            continue
+        results[name] = {
+            "count": counts[name],
+            "p50": percentile(ordered, 0.50) * 1000,
+            "p95": percentile(ordered, 0.95) * 1000,
+            "p99": percentile(ordered, 0.99) * 1000,
+            "max": ordered[-1] * 1000,
+        }
+    return results
+
+
+def report():
+    lines = [
+        f"{'span':<28}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    ]
+    for name, stats in summary().items():
+        lines.append(
+            f"{name:<28}{stats['count']:>8}"
+            f"{stats['p50']:>10.2f}{stats['p95']:>10.2f}"
+            f"{stats['p99']:>10.2f}{stats['max']:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+def dump(path=None):
+    # Print the table, and also save it as JSON when given somewhere to
+    print("Latency (ms):")
+    print(report())
+    if path is not None:
+        with open(path, "w") as dumpFile:
+            json.dump(summary(), dumpFile, indent=2)
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _counts.clear()